@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+import polars as pl
+import http_client
+import compression
+import sync_store
+from endpoints import ENDPOINTS
+from schema_utils import get_schema, rows_to_df
+from response_cache import response_cache
+from flatten import normalize
+from formats import ndjson_lines, dataframe_to_bytes
+
+# Seconds between background refreshes of the analytics tables (opt-in: every run syncs
+# reservations and folios into the local store; 0 disables the scheduler)
+ANALYTICS_REFRESH = int(os.getenv("APALEO_ANALYTICS_REFRESH", "0"))
+
+
+# Aggregations; each takes LazyFrames of its sources and returns a LazyFrame
+
+def reservations_per_property(reservations: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        normalize("reservations", reservations)
+        .group_by("property_id")
+        .agg(pl.len().alias("reservations"))
+        .sort("reservations", descending=True)
+    )
+
+
+def unit_summary(units: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        normalize("units", units)
+        .group_by(["property_id", "unit_group_id"])
+        .agg([
+            pl.len().alias("num_units"),
+            pl.sum("maxPersons").alias("total_capacity"),
+            pl.sum("is_occupied").alias("units_occupied"),
+        ])
+        .sort(["property_id", "unit_group_id"])
+    )
+
+
+def folio_balances(folios: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        normalize("folios", folios)
+        .group_by(["id", "currency"])
+        .agg(pl.sum("amount").alias("total_balance"))
+        .sort("id")
+    )
+
+
+# Source loaders. Entities kept in the local store are synced incrementally and
+# scanned from Parquet; the rest are fetched through the response cache.
+def _load_source(name: str) -> pl.LazyFrame:
+    if name in sync_store.SYNC_ENTITIES:
+        sync_store.sync(name)
+        return sync_store.scan_store(name)
+    endpoint = ENDPOINTS[name]
+    if endpoint["paged"]:
+        data = http_client.fetch_all_pages(endpoint["path"], endpoint["list_key"], fetch_json=response_cache.fetch_json)
+    else:
+        data = response_cache.fetch_json(endpoint["path"])
+    rows = data.get(endpoint["list_key"], [])
+    schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], rows=rows)[endpoint["list_key"]][0]
+    return rows_to_df(rows, schema).lazy()
+
+
+# Route name -> source entities and the aggregation built from them
+ANALYTICS = {
+    "reservations-per-property": {"sources": ["reservations"], "build": reservations_per_property},
+    "unit-summary": {"sources": ["units"], "build": unit_summary},
+    "folio-balances": {"sources": ["folios"], "build": folio_balances},
+}
+
+
+class MaterializedTable:
+    # Result of one aggregation plus its serialized bodies, so a read only copies bytes
+    def __init__(self, name: str, sources: list, build):
+        self.name = name
+        self.sources = sources
+        self.build = build
+        self.df = None
+        self.refreshed_at = None
+        self.duration = None
+        self.error = None
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        started = time.monotonic()
+        try:
+            df = self.build(*[_load_source(source) for source in self.sources]).collect()
+        except Exception as e:
+            self.error = str(e)
+            print(f"[ERROR] Refreshing analytics '{self.name}' failed: {e}")
+            raise
+        refreshed_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        rows = df.to_dicts()
+        body = json.dumps({"rows": rows, "count": len(rows), "refreshedAt": refreshed_at}, default=str)
+        with self._lock:
+            self.df = df
+            self.refreshed_at = refreshed_at
+            self.duration = round(time.monotonic() - started, 3)
+            self.error = None
+            self._bodies = {"json": body.encode("utf-8")}
+
+    # Serialized table in the given format and content encoding; refreshed on first use
+    def body(self, fmt: str = "json", encoding: str = None) -> bytes:
+        if self.df is None:
+            with self._refresh_lock:
+                if self.df is None:
+                    self._refresh()
+        with self._lock:
+            cached = self._bodies.get((fmt, encoding) if encoding else fmt)
+            plain = self._bodies.get(fmt)
+            df = self.df
+        if cached is not None:
+            return cached
+        if plain is not None:
+            cached = plain
+        elif fmt == "ndjson":
+            cached = ndjson_lines(df.to_dicts())
+        else:
+            cached = dataframe_to_bytes(df, fmt)
+        with self._lock:
+            if self.df is df:
+                self._bodies[fmt] = cached
+        if encoding:
+            cached = compression.compress(cached, encoding)
+            with self._lock:
+                if self.df is df:
+                    self._bodies[(fmt, encoding)] = cached
+        return cached
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "sources": self.sources,
+                "rows": None if self.df is None else self.df.height,
+                "refreshedAt": self.refreshed_at,
+                "durationSeconds": self.duration,
+                "error": self.error,
+            }
+
+
+tables = {name: MaterializedTable(name, config["sources"], config["build"]) for name, config in ANALYTICS.items()}
+
+
+# Refreshes all tables one after another, then sleeps for the interval
+class AnalyticsScheduler:
+    def __init__(self, interval: int = ANALYTICS_REFRESH):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="analytics-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for table in tables.values():
+                if self._stop.is_set():
+                    return
+                try:
+                    table.refresh()
+                except Exception:
+                    pass    # logged by refresh(); the previous result keeps being served
+            self._stop.wait(self.interval)
+
+
+scheduler = AnalyticsScheduler()
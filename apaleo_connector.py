@@ -1,33 +1,238 @@
 import os
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
-import requests
 from dotenv import load_dotenv
-from auth import get_access_token 
-from schema_utils import get_schema
+import polars as pl
+from schema_utils import get_schema, rows_to_df, schema_registry, SCHEMA_SAMPLE_ROWS
+from formats import FORMATS, negotiate_format, ndjson_lines, dataframe_to_bytes
 from urllib.parse import parse_qs
+import http_client
+import compression
+from compression import compressed_documents
+from endpoints import ENDPOINTS, AGE_CATEGORIES
+from response_cache import response_cache, SerializedItems
+from disk_cache import DiskCache, DISK_CACHE_PATH
+from rate_limiter import rate_limiter
+from fanout import fan_out, fetch_per_property, property_list
+import analytics
+import warmup
+import metrics
+import webhooks
 
-# Load BASE_URL from .env
 load_dotenv()
-BASE_URL = os.getenv("APALEO_BASE_URL")
 
-def fetch_data_from_apaleo(endpoint, token):
-    url = f"{BASE_URL}{endpoint}"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.text
+# Seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = int(os.getenv("CONNECTOR_KEEPALIVE_TIMEOUT", "15"))
+# Adds a Server-Timing header (and trailer on chunked responses) with the per-request breakdown
+SERVER_TIMING = os.getenv("CONNECTOR_SERVER_TIMING", "false").lower() == "true"
+
+# Largest webhook body accepted
+MAX_WEBHOOK_BYTES = 1024 * 1024
+
+# Paths reported as their own route in /metrics; anything else counts as "other"
+STATIC_ROUTES = {"/", "/age-categories", "/age-categories/schema", "/cache/stats", "/limiter/stats",
+                 "/metrics", "/warmup/status", "/analytics", "/webhooks/apaleo", "/webhooks/stats", "/bundle"}
+KNOWN_ROUTES = (
+    STATIC_ROUTES
+    | {f"/{name}" for name in ENDPOINTS}
+    | {f"/{name}/schema" for name in ENDPOINTS}
+    | {f"/analytics/{name}" for name in analytics.tables}
+)
+
+def route_label(path: str) -> str:
+    path = "/" + path.strip("/") if path != "/" else path
+    return path if path in KNOWN_ROUTES else "other"
+
+def _page_chunks(endpoint: dict, pages):
+    list_key = endpoint["list_key"]
+    count = 0
+    total = 0
+    yield f'{{"{list_key}": ['.encode("utf-8")
+    for page in pages:
+        total = total or page.get("count", 0)
+        items = page.get(list_key, [])
+        if not items:
+            continue
+        if count:
+            yield b", "
+        if isinstance(items, SerializedItems):
+            yield items.body
+        else:
+            # Keep the schema registry current from rows we have parsed anyway
+            schema_registry.observe(endpoint["path"], items)
+            yield ", ".join(json.dumps(item) for item in items).encode("utf-8")
+        count += len(items)
+    yield f'], "count": {max(total, count)}}}'.encode("utf-8")
+
+# Query options of the connector itself, not passed on to Apaleo
+LOCAL_PARAMS = {"format", "pretty"}
+
+def _query_params(query: dict) -> dict:
+    return {key: ",".join(values) for key, values in query.items() if key not in LOCAL_PARAMS}
+
+# Indentation for JSON bodies; compact unless the client asks for ?pretty=true
+def json_indent(query: dict):
+    return 2 if (query.get("pretty") or [""])[0].lower() in ("1", "true", "yes") else None
+
+# Yields the parsed pages of a registered endpoint through the response cache.
+# The first page is fetched up front so upstream errors surface before any header is sent.
+# If sources is a list, the (cache key, entry) of every page is appended to it.
+# With serialized, the items of each page are SerializedItems kept on its cache entry.
+def iter_endpoint_pages(endpoint: dict, params: dict, no_cache: bool = False, sources: list = None,
+                        serialized: bool = False):
+    def observe(items):
+        schema_registry.observe(endpoint["path"], items)
+
+    def fetch_json(relative_path, page_params):
+        entry = response_cache.fetch(relative_path, page_params, no_cache=no_cache)
+        key = response_cache.key(relative_path, page_params)
+        if sources is not None:
+            sources.append((key, entry))
+        if serialized:
+            return response_cache.serialized_page(key, entry, endpoint["list_key"], on_parse=observe)
+        return entry.json()
+
+    if endpoint["paged"] and "pageNumber" not in params:
+        pages = http_client.iter_pages(endpoint["path"], endpoint["list_key"], params=params, fetch_json=fetch_json)
+        first_page = next(pages)
+        return itertools.chain([first_page], pages)
+    return iter([fetch_json(endpoint["path"], params)])
+
+# Streams all pages of a list endpoint as one JSON document, page by page.
+# With an encoding, the document is compressed as it is streamed and kept compressed
+# for later requests while all of its pages are unchanged in the response cache.
+def stream_pages_json(endpoint: dict, params: dict, no_cache: bool = False, encoding: str = None):
+    if encoding is None:
+        return {}, _page_chunks(endpoint, iter_endpoint_pages(endpoint, params, no_cache, serialized=True))
+    document_key = (response_cache.key(endpoint["path"], params), encoding)
+    if not no_cache:
+        body = compressed_documents.get(document_key, response_cache.is_current)
+        if body is not None:
+            return {"Content-Length": str(len(body)), "Content-Encoding": encoding}, iter([body])
+    sources = []
+    chunks = _page_chunks(endpoint, iter_endpoint_pages(endpoint, params, no_cache, sources, serialized=True))
+    return compression.encode_stream(chunks, {}, encoding,
+                                     on_complete=lambda body: compressed_documents.put(document_key, body, sources))
+
+# Opens a registered endpoint as (headers, body chunks), served through the response cache.
+# List endpoints are paged through unless the client asks for a specific page.
+def open_endpoint_stream(endpoint: dict, query: dict, accept_encoding: str = "", no_cache: bool = False):
+    params = _query_params(query)
+    if endpoint["paged"] and "pageNumber" not in params:
+        return stream_pages_json(endpoint, params, no_cache, compression.negotiate(accept_encoding))
+    return response_cache.open_stream(endpoint["path"], params, accept_encoding, no_cache)
+
+def _ndjson_chunks(endpoint: dict, pages):
+    for page in pages:
+        items = page.get(endpoint["list_key"], [])
+        if items:
+            schema_registry.observe(endpoint["path"], items)
+            yield ndjson_lines(items)
+
+# Collects all rows of a registered endpoint into a typed DataFrame
+def endpoint_dataframe(endpoint: dict, params: dict, no_cache: bool = False) -> pl.DataFrame:
+    rows = []
+    for page in iter_endpoint_pages(endpoint, params, no_cache):
+        rows.extend(page.get(endpoint["list_key"], []))
+    schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], rows=rows)[endpoint["list_key"]][0]
+    return rows_to_df(rows, schema)
+
+# Opens a registered endpoint in a non-JSON format: NDJSON is streamed page by page,
+# Arrow IPC and Parquet are built from the typed DataFrame.
+def open_endpoint_format(endpoint: dict, query: dict, fmt: str, no_cache: bool = False):
+    params = _query_params(query)
+    if fmt == "ndjson":
+        return {}, _ndjson_chunks(endpoint, iter_endpoint_pages(endpoint, params, no_cache))
+    body = dataframe_to_bytes(endpoint_dataframe(endpoint, params, no_cache), fmt)
+    return {"Content-Length": str(len(body))}, iter([body])
+
+# Query options of /bundle itself; all others are passed to every entity
+BUNDLE_PARAMS = {"entities"}
+
+# Opens several registered endpoints as one JSON document: {"<name>": <body of /<name>>, ...,
+# "errors": [...]}. All entities are fetched upstream concurrently into the response cache
+# first, then streamed one after another from it, so the total wait is the slowest entity.
+def open_bundle(names: list, query: dict, no_cache: bool = False):
+    params = {key: value for key, value in _query_params(query).items() if key not in BUNDLE_PARAMS}
+
+    def prefetch(name):
+        for _ in iter_endpoint_pages(ENDPOINTS[name], params, no_cache, serialized=True):
+            pass
+
+    fetched, errors = fan_out(names, prefetch, max_workers=len(names))
+    if not fetched:
+        raise Exception("; ".join(f"{name}: {message}" for name, message in errors.items()))
+    return {}, _bundle_chunks([name for name in names if name in fetched], params, errors)
+
+def _bundle_chunks(names: list, params: dict, errors: dict):
+    yield b"{"
+    for name in names:
+        yield f'"{name}": '.encode("utf-8")
+        yield from _page_chunks(ENDPOINTS[name], iter_endpoint_pages(ENDPOINTS[name], params, serialized=True))
+        yield b", "
+    error_list = [{"entity": name, "error": message} for name, message in errors.items()]
+    yield f'"errors": {json.dumps(error_list)}}}'.encode("utf-8")
 
 # HTTP request handler class
 class ApaleoHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 for keep-alive and chunked transfer encoding
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+
+    # A worker slot is only held while a request is handled, not while a keep-alive
+    # connection waits for the next one
+    def handle_one_request(self):
+        try:
+            if not self.rfile.peek(1):
+                self.close_connection = True
+                return
+        except OSError:
+            # Idle for KEEPALIVE_TIMEOUT, or the client went away
+            self.close_connection = True
+            return
+        if not self.server.acquire_worker():
+            self.server.reject(self.connection)
+            self.close_connection = True
+            return
+        try:
+            super().handle_one_request()
+        finally:
+            self.server.release_worker()
+
     def do_GET(self):
-        path = urlparse(self.path).path
+        self._instrumented(self._handle_get)
+
+    def do_POST(self):
+        self._instrumented(self._handle_post)
+
+    def _instrumented(self, handle):
+        self._status = None
+        self._timing = metrics.Timing()
+        context_token = metrics.current_timing.set(self._timing)
+        metrics.requests_in_flight.inc()
+        try:
+            handle()
+        finally:
+            metrics.requests_in_flight.dec()
+            metrics.current_timing.reset(context_token)
+            route = route_label(urlparse(self.path).path)
+            metrics.requests_total.inc(route, self._status or 0)
+            metrics.request_seconds.observe(self._timing.elapsed(), route)
+            metrics.request_upstream_seconds.observe(self._timing.get("upstream"), route)
+
+    def _handle_get(self):
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+        query = parsed_url.query
+        route = path.strip("/")
+        indent = json_indent(parse_qs(query))
 
         if path == "/":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.end_headers()
             html = """
             <html>
                 <head>
@@ -47,264 +252,337 @@ class ApaleoHandler(BaseHTTPRequestHandler):
                         <li><a href="/services">Services</a> — <a href="/services/schema">Schema</a></li>
                         <li><a href="/capture-policies">capture-policies</a> — <a href="/capture-policies/schema">Schema</a></li>
                         <li><a href="/age-categories">Age Categories</a> — <a href="/age-categories/schema">Schema</a></li>
+                        <li><a href="/bundle?entities=reservations,units,unit-groups,folios,properties">Bundle</a></li>
+                        <li><a href="/analytics">Analytics</a></li>
+                        <li><a href="/warmup/status">Warm-up Status</a></li>
+                        <li><a href="/metrics">Metrics</a></li>
                     </ul>
                 </body>
             </html>
             """
-            self.wfile.write(html.encode("utf-8"))
+            self._send_body(html.encode("utf-8"), "text/html")
 
-        elif path == "/reservations":
+        elif path == "/age-categories":
             try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/booking/v1/reservations", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
+                parsed_query = parse_qs(query)
+                requested_ids = []
+                if "propertyId" in parsed_query:
+                    for value in parsed_query["propertyId"]:
+                        requested_ids.extend(pid.strip().upper() for pid in value.split(",") if pid.strip())
+                categories, errors = fetch_per_property(AGE_CATEGORIES, requested_ids, fetch_json=response_cache.fetch_json)
+                if categories:
+                    schema_registry.observe(AGE_CATEGORIES["path"], categories)
+                body = {
+                    AGE_CATEGORIES["list_key"]: categories,
+                    "count": len(categories),
+                    "errors": [{"propertyId": pid, "error": message} for pid, message in errors.items()],
+                }
+                self._send_json(json.dumps(body, indent=indent).encode("utf-8"))
             except Exception as e:
                 self.send_error(500, str(e))
 
-        elif path == "/reservations/schema":
+        elif path == "/age-categories/schema":
             try:
-                schema = get_schema("/booking/v1/reservations", list_key="reservations")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
+                property_ids = property_list.get(response_cache.fetch_json)
+                if not property_ids:
+                    raise Exception("No properties found for schema generation.")
+                schema = get_schema(AGE_CATEGORIES["path"], list_key=AGE_CATEGORIES["list_key"],
+                                    params={"propertyId": property_ids[0]}, fetch_json=response_cache.fetch_json)
+                self._send_schema(AGE_CATEGORIES, schema, indent)
             except Exception as e:
                 self.send_error(500, str(e))
 
-        elif path == "/bookings":
-            try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/booking/v1/bookings", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))      
-
-        elif path == "/bookings/schema":
+        elif path == "/bundle":
+            parsed_query = parse_qs(query)
+            names = []
+            for value in parsed_query.get("entities", []):
+                names.extend(name.strip() for name in value.split(",") if name.strip())
+            names = list(dict.fromkeys(names))
+            unknown = [name for name in names if name not in ENDPOINTS]
+            if not names or unknown:
+                self.send_error(400, f"Unknown entities: {', '.join(unknown)}" if unknown
+                                else f"Pass ?entities=..., any of: {', '.join(ENDPOINTS)}")
+                return
             try:
-                schema = get_schema("/booking/v1/bookings", list_key="bookings")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
+                no_cache = "no-cache" in self.headers.get("Cache-Control", "")
+                headers, chunks = open_bundle(names, parsed_query, no_cache)
+                headers, chunks = compression.encode_stream(chunks, headers,
+                                                            compression.negotiate(self.headers.get("Accept-Encoding", "")))
             except Exception as e:
                 self.send_error(500, str(e))
+            else:
+                self._send_stream(chunks, headers)
 
-        elif path == "/folios":
-            try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/finance/v1/folios", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/cache/stats":
+            self._send_json(json.dumps(response_cache.snapshot(), indent=indent).encode("utf-8"))
 
-        elif path == "/folios/schema":
-            try:
-                schema = get_schema("/finance/v1/folios", list_key="folios")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/limiter/stats":
+            self._send_json(json.dumps(rate_limiter.snapshot(), indent=indent).encode("utf-8"))
 
-        elif path == "/properties":
-            try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/inventory/v1/properties", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/metrics":
+            self._send_body(metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
 
-        elif path == "/properties/schema":
-            try:
-                schema = get_schema("/inventory/v1/properties", list_key="properties")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/webhooks/stats":
+            self._send_json(json.dumps(webhooks.batcher.snapshot(), indent=indent).encode("utf-8"))
 
-        elif path == "/unit-groups":
-            try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/inventory/v1/unit-groups", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/warmup/status":
+            self._send_json(json.dumps(warmup.scheduler.snapshot(), indent=indent).encode("utf-8"))
 
-        elif path == "/unit-groups/schema":
-            try:
-                schema = get_schema("/inventory/v1/unit-groups", list_key="unitGroups")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        elif path == "/analytics":
+            status = {name: table.status() for name, table in analytics.tables.items()}
+            self._send_json(json.dumps(status, indent=indent).encode("utf-8"))
 
-        elif path == "/units":
+        elif route.startswith("analytics/") and route[len("analytics/"):] in analytics.tables:
             try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/inventory/v1/units", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
-
-        elif path == "/units/schema":
+                fmt = negotiate_format(parse_qs(query), self.headers.get("Accept", ""))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            table = analytics.tables[route[len("analytics/"):]]
+            encoding = compression.negotiate(self.headers.get("Accept-Encoding", ""), FORMATS[fmt])
+            headers = {}
             try:
-                schema = get_schema("/inventory/v1/units", list_key="units")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
+                body = table.body(fmt)
+                # Read after body(), which refreshes the table on first use
+                headers["X-Refreshed-At"] = table.refreshed_at
+                if encoding and len(body) >= compression.COMPRESSION_MIN_BYTES:
+                    # Compressed once per refresh, not per request
+                    body = table.body(fmt, encoding)
+                    headers["Content-Encoding"] = encoding
             except Exception as e:
                 self.send_error(500, str(e))
+            else:
+                self._send_body(body, FORMATS[fmt], headers=headers)
 
-        elif path == "/sources":
+        elif route in ENDPOINTS:
+            parsed_query = parse_qs(query)
             try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/booking/v1/types/sources", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
-
-        elif path == "/sources/schema":
+                fmt = negotiate_format(parsed_query, self.headers.get("Accept", ""))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
             try:
-                schema = get_schema("/booking/v1/types/sources", list_key="sources")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
+                no_cache = "no-cache" in self.headers.get("Cache-Control", "")
+                accept_encoding = self.headers.get("Accept-Encoding", "")
+                if fmt == "json":
+                    headers, chunks = open_endpoint_stream(ENDPOINTS[route], parsed_query, accept_encoding, no_cache)
+                else:
+                    headers, chunks = open_endpoint_format(ENDPOINTS[route], parsed_query, fmt, no_cache)
+                # Anything not yet encoded by the cache is compressed while it is streamed
+                headers, chunks = compression.encode_stream(chunks, headers,
+                                                            compression.negotiate(accept_encoding, FORMATS[fmt]))
             except Exception as e:
                 self.send_error(500, str(e))
+            else:
+                self._send_stream(chunks, headers, FORMATS[fmt])
 
-        elif path == "/services":
+        elif route.endswith("/schema") and route[:-len("/schema")] in ENDPOINTS:
             try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo("/rateplan/v1/services", token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
+                endpoint = ENDPOINTS[route[:-len("/schema")]]
+                # Inferred from rows already served, or else from one small page
+                sample = {"pageNumber": 1, "pageSize": SCHEMA_SAMPLE_ROWS} if endpoint["paged"] else None
+                schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], params=sample,
+                                    fetch_json=response_cache.fetch_json)
+                self._send_schema(endpoint, schema, indent)
             except Exception as e:
                 self.send_error(500, str(e))
 
-        elif path == "/services/schema":
-            try:
-                schema = get_schema("/rateplan/v1/services", list_key="services")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+        else:
+            self.send_error(404, "Not Found")
 
-        elif path == "/capture-policies":
-            try:
-                token = get_access_token()
-                data = fetch_data_from_apaleo('/settings/v1/capture-policies', token)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(data.encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+    def _handle_post(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path != "/webhooks/apaleo":
+            self.send_error(404, "Not Found")
+            return
+        if not webhooks.WEBHOOK_SECRET:
+            self.send_error(404, "Webhooks are disabled, set APALEO_WEBHOOK_SECRET")
+            return
+        if not webhooks.authorized(parse_qs(parsed_url.query), self.headers):
+            self.send_error(403, "Invalid webhook secret")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return
+        if length > MAX_WEBHOOK_BYTES:
+            self.send_error(413, "Payload too large")
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self.send_error(400, "Body must be JSON")
+            return
+        # One event or a list of events
+        events = payload if isinstance(payload, list) else [payload]
+        accepted = webhooks.batcher.submit(events)
+        self._send_json(json.dumps({"accepted": accepted, "ignored": len(events) - accepted}).encode("utf-8"), status=202)
 
-        elif path == "/capture-policies/schema":
-            try:
-                schema = get_schema("/settings/v1/capture-policies", list_key="capturePolicies")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+        if SERVER_TIMING and getattr(self, "_timing", None) is not None:
+            self.send_header("Server-Timing", self._timing.header())
 
-        elif path == "/age-categories":
-            try:
-                token = get_access_token()
-                query = urlparse(self.path).query
-                parsed_query = parse_qs(query)
-                requested_ids = []
-                if "propertyId" in parsed_query:
-                    for value in parsed_query["propertyId"]:
-                        requested_ids.extend(pid.strip().upper() for pid in value.split(",") if pid.strip())
-                if not requested_ids:
-                    prop_response = fetch_data_from_apaleo("/inventory/v1/properties", token)
-                    prop_data = json.loads(prop_response)
-                    requested_ids = [p["id"] for p in prop_data.get("properties", [])]
-                all_data = []
-                for prop_id in requested_ids:
-                    endpoint = f"/settings/v1/age-categories?propertyId={prop_id}"
-                    try:
-                        response = fetch_data_from_apaleo(endpoint, token)
-                        parsed = json.loads(response)
-                        categories = parsed.get("ageCategories", [])
-                        if categories:
-                            for cat in categories:
-                                cat["propertyId"] = cat.get("propertyId", prop_id)
-                                all_data.append(cat)
-                        else:
-                            print(f"[INFO] No age categories for {prop_id}")
-                    except Exception as e:
-                        print(f"[ERROR] Failed to fetch for {prop_id}: {e}")
-                        continue
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(all_data, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+    # Time spent building the response, outside of token, limiter and upstream waits
+    def _mark_serialized(self):
+        waited = sum(self._timing.get(phase) for phase in ("token", "limiter", "connect", "upstream"))
+        self._timing.add("serialize", max(0.0, self._timing.elapsed() - waited))
 
-        elif path == "/age-categories/schema":
-            try:
-                token = get_access_token()
-                prop_response = fetch_data_from_apaleo("/inventory/v1/properties", token)
-                prop_data = json.loads(prop_response)
-                properties = prop_data.get("properties", [])
-                if not properties:
-                    raise Exception("No properties found for schema generation.")
-                first_id = properties[0].get("id")
-                if not first_id:
-                    raise Exception("No valid propertyId found.")
-                schema = get_schema(f"/settings/v1/age-categories?propertyId={first_id}", list_key="ageCategories")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(schema, indent=2).encode("utf-8"))
-            except Exception as e:
-                self.send_error(500, str(e))
+    # Compresses the body if the client accepts it, unless headers already name an encoding
+    def _send_body(self, body: bytes, content_type: str, status: int = 200, headers: dict = None):
+        headers = dict(headers or {})
+        encoding = compression.negotiate(self.headers.get("Accept-Encoding", ""), content_type)
+        if encoding and "Content-Encoding" not in headers and len(body) >= compression.COMPRESSION_MIN_BYTES:
+            body = compression.compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        self._mark_serialized()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self._send_vary(content_type)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        with metrics.phase("write"):
+            self.wfile.write(body)
+
+    def _send_json(self, body: bytes, status: int = 200, headers: dict = None):
+        self._send_body(body, "application/json", status, headers)
+
+    def _send_schema(self, endpoint: dict, schema: dict, indent: int = None):
+        version = schema_registry.version(endpoint["path"])
+        self._send_json(json.dumps(schema, indent=indent).encode("utf-8"), headers={"X-Schema-Version": str(version)})
+
+    # Caches must keep the variants per Accept-Encoding apart
+    def _send_vary(self, content_type: str):
+        if compression.COMPRESSION and content_type not in compression.INCOMPRESSIBLE_TYPES:
+            self.send_header("Vary", "Accept-Encoding")
+
+    # Writes body chunks as they arrive: with the given Content-Length, or chunked.
+    # Producing the chunks counts as serialize time, including waits for later pages.
+    def _send_stream(self, chunks, headers: dict, content_type: str = "application/json"):
+        chunked = "Content-Length" not in headers
+        self._mark_serialized()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self._send_vary(content_type)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            if SERVER_TIMING:
+                self.send_header("Trailer", "Server-Timing")
+        self.end_headers()
+        try:
+            chunks_iter = iter(chunks)
+            while True:
+                with metrics.phase("serialize"):
+                    chunk = next(chunks_iter, None)
+                if chunk is None:
+                    break
+                if not chunk:
+                    continue
+                if chunked:
+                    chunk = b"%x\r\n%s\r\n" % (len(chunk), chunk)
+                with metrics.phase("write"):
+                    self.wfile.write(chunk)
+            if chunked and SERVER_TIMING:
+                self.wfile.write(b"0\r\nServer-Timing: %s\r\n\r\n" % self._timing.header().encode("ascii"))
+            elif chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:
+            # Headers are already sent; drop the connection so the client sees a truncated body
+            print(f"[ERROR] Streaming {self.path} aborted: {e}")
+            self.close_connection = True
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+# Threaded server that caps the number of requests handled at once, and separately
+# the number of open (possibly idle keep-alive) connections.
+# Once all slots are busy, requests get an immediate 503 instead of queueing.
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    busy_response = (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Retry-After: 1\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"Content-Length: 20\r\n"
+        b"Connection: close\r\n\r\n"
+        b"Server is saturated\n"
+    )
+
+    def __init__(self, server_address, handler_class, max_workers: int = 16, backlog: int = 64,
+                 max_connections: int = 256):
+        # Listen backlog for connections the kernel accepts before we do
+        self.request_queue_size = backlog
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._connections = threading.BoundedSemaphore(max(max_connections, max_workers))
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        if not self._connections.acquire(blocking=False):
+            self.reject(request)
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._connections.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._connections.release()
+
+    def acquire_worker(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release_worker(self):
+        self._slots.release()
+
+    def reject(self, request):
+        metrics.requests_rejected.inc()
+        try:
+            request.sendall(self.busy_response)
+        except OSError:
+            pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local HTTP connector for the Apaleo API")
+    parser.add_argument("--host", default=os.getenv("CONNECTOR_HOST", ""), help="Interface to bind (default: all)")
+    parser.add_argument("--port", type=int, default=int(os.getenv("CONNECTOR_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CONNECTOR_WORKERS", "16")),
+                        help="Max requests handled concurrently; more get a 503")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("CONNECTOR_BACKLOG", "64")),
+                        help="Listen backlog for not yet accepted connections")
+    parser.add_argument("--max-connections", type=int, default=int(os.getenv("CONNECTOR_MAX_CONNECTIONS", "256")),
+                        help="Max open client connections, idle keep-alive ones included; more get a 503")
+    return parser.parse_args()
 
-        else:
-            self.send_error(404, "Not Found")
 
 if __name__ == "__main__":
-    port = 8000
-    server_address = ("", port)
-    httpd = HTTPServer(server_address, ApaleoHandler)
-    print(f"Running at: http://localhost:{port}")
+    args = parse_args()
+    server_address = (args.host, args.port)
+    httpd = BoundedThreadingHTTPServer(server_address, ApaleoHandler, max_workers=args.workers, backlog=args.backlog,
+                                       max_connections=args.max_connections)
+    if DISK_CACHE_PATH:
+        response_cache.attach_disk(DiskCache())
+    warmed = response_cache.warm_start()
+    if warmed:
+        print(f"[INFO] {warmed} cached responses loaded from disk")
+    if warmup.WARMUP_ENABLED:
+        warmup.scheduler.start()
+    if analytics.ANALYTICS_REFRESH > 0:
+        analytics.scheduler.start()
+    print(f"Running at: http://{args.host or 'localhost'}:{args.port} ({args.workers} workers)")
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
@@ -1,12 +1,28 @@
 import os
-import requests
+import json
+import time
+import threading
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, the file is still shared
+    fcntl = None
+
 load_dotenv()
 
-def get_access_token():
-    url = "https://identity.apaleo.com/connect/token"
-     # Prepare the data payload for the token request
+# Identity server; point it at a local stand-in (see fake_apaleo.py) to run without credentials
+TOKEN_URL = os.getenv("APALEO_TOKEN_URL", "https://identity.apaleo.com/connect/token")
+# A token is only handed out while it has at least this many seconds left
+TOKEN_MIN_TTL = int(os.getenv("APALEO_TOKEN_MIN_TTL", "30"))
+# The background refresh starts this many seconds before the token expires
+TOKEN_REFRESH_AHEAD = int(os.getenv("APALEO_TOKEN_REFRESH_AHEAD", "120"))
+# Optional file to share one token between several worker processes
+TOKEN_CACHE_FILE = os.getenv("APALEO_TOKEN_CACHE_FILE")
+
+
+def request_token():
+    # Prepare the data payload for the token request
     data = {
         "grant_type": "client_credentials",
         "client_id": os.getenv("APALEO_CLIENT_ID"),
@@ -15,11 +31,171 @@ def get_access_token():
     }
     # Set headers for the HTTP request
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    # Make a POST request to get the access token
-    response = requests.post(url, data=data, headers=headers)
+    # Make a POST request to get the access token, over the shared connection pool
+    # (imported here because http_client imports this module)
+    import http_client
+    response = http_client.get_session().post(TOKEN_URL, data=data, headers=headers,
+                                              timeout=(http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT))
     response.raise_for_status()
-    # Return the access token from the response
-    return response.json()["access_token"]
+    # Return the full token response (access_token, expires_in, ...)
+    return response.json()
+
+
+class TokenManager:
+    # Caches the access token until shortly before it expires.
+    # Only one refresh runs at a time; concurrent callers wait for it.
+    def __init__(self, min_ttl=TOKEN_MIN_TTL, refresh_ahead=TOKEN_REFRESH_AHEAD, cache_file=TOKEN_CACHE_FILE):
+        self.min_ttl = min_ttl
+        self.refresh_ahead = max(refresh_ahead, min_ttl)
+        self.cache_file = cache_file
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "refreshes": 0,
+            "background_refreshes": 0,
+            "file_loads": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _is_valid(self, now=None):
+        now = time.time() if now is None else now
+        return self._token is not None and now < self._expires_at - self.min_ttl
+
+    def get_token(self):
+        if self._is_valid():
+            self._count("hits")
+            return self._token
+        # Single flight: the first caller refreshes, the others block here
+        with self._refresh_lock:
+            if self._is_valid():
+                self._count("hits")
+                return self._token
+            self._refresh()
+            return self._token
+
+    def invalidate(self, token=None):
+        # Drop the cached token, e.g. after an upstream 401. With a token, only if it is
+        # still the cached one, so a token another caller just refreshed is kept.
+        with self._refresh_lock:
+            if token is not None and token != self._token:
+                return
+            self._token = None
+            self._expires_at = 0.0
+
+    # Returns True if a new token was requested, False if it was loaded from the cache file
+    def _refresh(self):
+        # Caller must hold _refresh_lock
+        if self._load_from_file():
+            self._count("file_loads")
+            self._schedule_background_refresh()
+            return False
+        lock_file = self._acquire_file_lock()
+        try:
+            # Another process may have refreshed while we waited for the file lock
+            requested = not self._load_from_file()
+            if not requested:
+                self._count("file_loads")
+            else:
+                try:
+                    payload = request_token()
+                except Exception:
+                    self._count("errors")
+                    raise
+                self._token = payload["access_token"]
+                self._expires_at = time.time() + int(payload.get("expires_in", 3600))
+                self._count("refreshes")
+                self._save_to_file()
+        finally:
+            self._release_file_lock(lock_file)
+        self._schedule_background_refresh()
+        return requested
+
+    def _schedule_background_refresh(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = self._expires_at - self.refresh_ahead - time.time()
+        if delay <= 0:
+            return
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._refresh_lock:
+            # The current token stays usable for other callers while this runs
+            try:
+                if self._refresh():
+                    self._count("background_refreshes")
+            except Exception as e:
+                # The old token stays in place; the next caller retries synchronously
+                print(f"[ERROR] Background token refresh failed: {e}")
+
+    def _load_from_file(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get("expires_at", 0) - self.refresh_ahead <= time.time():
+            return False
+        self._token = cached["access_token"]
+        self._expires_at = cached["expires_at"]
+        return True
+
+    def _save_to_file(self):
+        if not self.cache_file:
+            return
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": self._token, "expires_at": self._expires_at}, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            print(f"[ERROR] Could not write token cache file: {e}")
+
+    def _acquire_file_lock(self):
+        if not self.cache_file or fcntl is None:
+            return None
+        try:
+            lock_file = open(f"{self.cache_file}.lock", "a")
+        except OSError:
+            return None
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _release_file_lock(self, lock_file):
+        if lock_file is None:
+            return
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+token_manager = TokenManager()
+
+
+def get_access_token():
+    return token_manager.get_token()
+
+
+def invalidate_token(token=None):
+    token_manager.invalidate(token)
+
+
+def token_stats():
+    with token_manager._stats_lock:
+        return dict(token_manager.stats)
+
 
 if __name__ == "__main__":
     token = get_access_token()
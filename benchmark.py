@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import math
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+
+# Offline benchmark: starts fake_apaleo.py and the connector as subprocesses, measures
+# route latency/throughput under concurrent clients and the load time and peak memory
+# of each load_*_df in polars_test.py, and writes the results as JSON.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROUTES = ["reservations", "folios", "bookings", "units", "unit-groups", "properties", "services",
+          "capture-policies", "sources", "age-categories", "reservations/schema"]
+# "<loader>:<option>" calls the loader with option=True, e.g. the streaming ingestion
+LOADERS = ["load_reservations_df", "load_reservations_df:streaming", "load_bookings_df", "load_folios_df",
+           "load_folios_df:streaming", "load_properties_df", "load_unit_groups_df", "load_units_df",
+           "load_services_df", "load_capturepolicies_df"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port: int, path: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing answered on port {port} within {timeout}s")
+
+
+def get_json(port: int, path: str):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("GET", path)
+    body = conn.getresponse().read()
+    conn.close()
+    return json.loads(body)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def child_env(fake_url: str, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "APALEO_BASE_URL": fake_url,
+        "APALEO_TOKEN_URL": f"{fake_url}/connect/token",
+        "APALEO_CLIENT_ID": "benchmark",
+        "APALEO_CLIENT_SECRET": "benchmark",
+        "APALEO_SCOPES": "reservations.read folios.read setup.read",
+        "APALEO_PAGE_SIZE": str(args.page_size),
+        "APALEO_DISK_CACHE_PATH": "",
+        "APALEO_WARMUP": "false",
+        "APALEO_ANALYTICS_REFRESH": "0",
+        "APALEO_STORE_DIR": os.path.join(tempfile.gettempdir(), "apaleo-benchmark-store"),
+    })
+    if not args.keep_rate_limit:
+        env.update({"APALEO_RATE_LIMIT": "100000", "APALEO_RATE_BURST": "100000", "APALEO_MAX_CONCURRENCY": "64"})
+    return env
+
+
+def start_process(command: list, env: dict, port: int, ready_path: str) -> subprocess.Popen:
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        wait_for(port, ready_path)
+    except TimeoutError:
+        process.kill()
+        raise RuntimeError(f"{' '.join(command)} did not start: {process.stderr.read().decode(errors='replace')}")
+    return process
+
+
+def bench_route(port: int, route: str, clients: int, requests_per_client: int, headers: dict) -> dict:
+    path = f"/{route}"
+    # The first request after startup, before anything is cached
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    first_body = response.read()
+    first_request = time.perf_counter() - started
+    conn.close()
+    if response.status != 200:
+        return {"error": f"HTTP {response.status}", "first_request_seconds": round(first_request, 4)}
+
+    latencies = []
+    errors = []
+    received = [0]
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        local = []
+        local_bytes = 0
+        for _ in range(requests_per_client):
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                r = conn.getresponse()
+                body = r.read()
+                if r.status != 200:
+                    raise Exception(f"HTTP {r.status}")
+            except Exception as e:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                with lock:
+                    errors.append(str(e))
+                continue
+            local.append(time.perf_counter() - t0)
+            local_bytes += len(body)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            received[0] += local_bytes
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "first_request_seconds": round(first_request, 4),
+        "body_bytes": len(first_body),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "throughput_mbps": round(received[0] / elapsed / 1e6, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p90": ms(percentile(latencies, 90)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+# Runs in a fresh process per loader, so peak RSS is not shared between loaders
+def run_loader(spec: str) -> dict:
+    import polars_test
+    name, _, option = spec.partition(":")
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    df = getattr(polars_test, name)(**({option: True} if option else {}))
+    seconds = time.perf_counter() - started
+    peak = peak_rss_mb()
+    return {
+        "seconds": round(seconds, 4),
+        "rows": df.height,
+        "columns": df.width,
+        "estimated_df_mb": round(df.estimated_size() / 1e6, 2),
+        "peak_rss_mb": peak,
+        "rss_growth_mb": round(peak - baseline, 1),
+    }
+
+
+def bench_loaders(env: dict, names: list) -> dict:
+    results = {}
+    for name in names:
+        process = subprocess.run([sys.executable, __file__, "--child-loader", name], cwd=HERE, env=env,
+                                 capture_output=True, text=True)
+        lines = process.stdout.strip().splitlines()
+        if process.returncode != 0 or not lines:
+            results[name] = {"error": (process.stderr.strip().splitlines() or ["failed"])[-1]}
+        else:
+            results[name] = json.loads(lines[-1])
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    import polars
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = child_env(fake_url, args)
+    fake = start_process([sys.executable, "fake_apaleo.py", "--port", str(fake_port), "--reservations", str(args.reservations),
+                          "--properties", str(args.properties), "--units-per-property", str(args.units_per_property),
+                          "--latency", str(args.latency), "--jitter", str(args.jitter),
+                          "--max-page-size", str(max(args.page_size, 1000))],
+                         env, fake_port, "/_stats")
+    result = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "polars": polars.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "child_loader")},
+        },
+    }
+    try:
+        if not args.skip_routes:
+            port = free_port()
+            connector = start_process([sys.executable, "apaleo_connector.py", "--host", "127.0.0.1", "--port", str(port),
+                                       "--workers", str(args.workers)], env, port, "/cache/stats")
+            try:
+                headers = {"Accept-Encoding": "gzip"} if args.gzip else {}
+                if args.no_cache:
+                    headers["Cache-Control"] = "no-cache"
+                result["routes"] = {}
+                for route in args.routes.split(","):
+                    result["routes"][route] = bench_route(port, route, args.clients, args.requests, headers)
+                    print(f"[INFO] /{route}: {json.dumps(result['routes'][route])}", file=sys.stderr)
+                result["connector"] = {"cache": get_json(port, "/cache/stats"), "limiter": get_json(port, "/limiter/stats")}
+            finally:
+                connector.terminate()
+                connector.wait()
+        if not args.skip_loaders:
+            result["loaders"] = bench_loaders(env, args.loaders.split(","))
+            for name, values in result["loaders"].items():
+                print(f"[INFO] {name}: {json.dumps(values)}", file=sys.stderr)
+        result["upstream"] = get_json(fake_port, "/_stats")
+    finally:
+        fake.terminate()
+        fake.wait()
+    return result
+
+
+# Flattens numeric results to {"routes.reservations.latency_ms.p99": value, ...}
+def _flatten(value, prefix="") -> dict:
+    if isinstance(value, dict):
+        flat = {}
+        for key, inner in value.items():
+            flat.update(_flatten(inner, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+# Prints the relative change of every shared metric against an earlier result file
+def compare(baseline: dict, current: dict):
+    old = _flatten({k: baseline.get(k) for k in ("routes", "loaders")})
+    new = _flatten({k: current.get(k) for k in ("routes", "loaders")})
+    print(f"{'metric':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key:<60} {before:>12} {after:>12} {change:>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the connector and loaders against a local fake Apaleo")
+    parser.add_argument("--reservations", type=int, default=10000, help="Synthetic reservations (and folios)")
+    parser.add_argument("--properties", type=int, default=5)
+    parser.add_argument("--units-per-property", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=500, help="APALEO_PAGE_SIZE used by the connector and loaders")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the fake adds to every API response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients per route")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client and route")
+    parser.add_argument("--workers", type=int, default=16, help="Connector --workers")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--loaders", default=",".join(LOADERS), help="Comma-separated load_*_df names, optionally with :streaming")
+    parser.add_argument("--gzip", action="store_true", help="Clients send Accept-Encoding: gzip")
+    parser.add_argument("--no-cache", action="store_true", help="Clients send Cache-Control: no-cache")
+    parser.add_argument("--keep-rate-limit", action="store_true",
+                        help="Keep the configured upstream rate limit instead of lifting it")
+    parser.add_argument("--skip-routes", action="store_true")
+    parser.add_argument("--skip-loaders", action="store_true")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--child-loader", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child_loader:
+        print(json.dumps(run_loader(args.child_loader)))
+        sys.exit(0)
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
@@ -0,0 +1,205 @@
+import os
+import zlib
+import weakref
+import threading
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is always available
+    zstandard = None
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# Compress responses for clients that send Accept-Encoding
+COMPRESSION = os.getenv("CONNECTOR_COMPRESSION", "true").lower() == "true"
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv("CONNECTOR_COMPRESSION_MIN_BYTES", "1024"))
+# zlib level for gzip (1 fastest .. 9 smallest)
+GZIP_LEVEL = int(os.getenv("CONNECTOR_GZIP_LEVEL", "6"))
+# Total size of compressed list documents kept for repeated requests
+COMPRESSED_CACHE_MAX_BYTES = int(os.getenv("CONNECTOR_COMPRESSED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Media types that are already compressed
+INCOMPRESSIBLE_TYPES = {"application/vnd.apache.parquet"}
+
+
+class _Brotli:
+    # brotli.Compressor with the compress/flush interface of zlib
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+# Supported encodings, most preferred first
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = lambda: zstandard.ZstdCompressor(level=3).compressobj()
+if brotli is not None:
+    ENCODERS["br"] = _Brotli
+ENCODERS["gzip"] = lambda: zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+# Picks the response encoding from an Accept-Encoding header, or None for identity
+def negotiate(accept_encoding: str, content_type: str = "application/json"):
+    if not COMPRESSION or not accept_encoding or content_type in INCOMPRESSIBLE_TYPES:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name] = q
+    best = None
+    for encoding in ENCODERS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > 0 and (best is None or q > weights.get(best, weights.get("*", 0.0))):
+            best = encoding
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    compressor = ENCODERS[encoding]()
+    return compressor.compress(body) + compressor.flush()
+
+
+# Compresses body chunks as they arrive; only one chunk is held at a time
+def compress_chunks(chunks, encoding: str):
+    compressor = ENCODERS[encoding]()
+    try:
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# Applies the content encoding to a (headers, chunks) response. Bodies of unknown length
+# are buffered until COMPRESSION_MIN_BYTES are reached, so short ones keep a Content-Length
+# and go out uncompressed. on_complete(body) receives the full compressed body, if it fits
+# into the compressed document cache.
+def encode_stream(chunks, headers: dict, encoding: str, on_complete=None):
+    if encoding is None or "Content-Encoding" in headers:
+        return headers, chunks
+    if "Content-Length" in headers and int(headers["Content-Length"]) < COMPRESSION_MIN_BYTES:
+        return headers, chunks
+    rest = iter(chunks)
+    buffered = []
+    if "Content-Length" not in headers:
+        size = 0
+        try:
+            while size < COMPRESSION_MIN_BYTES:
+                chunk = next(rest, None)
+                if chunk is None:
+                    body = b"".join(buffered)
+                    return {**headers, "Content-Length": str(len(body))}, iter([body])
+                buffered.append(chunk)
+                size += len(chunk)
+        except BaseException:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            raise
+    headers = {key: value for key, value in headers.items() if key != "Content-Length"}
+    headers["Content-Encoding"] = encoding
+    encoded = compress_chunks(_chain(buffered, rest, chunks), encoding)
+    if on_complete is not None:
+        encoded = collect(encoded, compressed_documents.max_bytes, on_complete)
+    return headers, encoded
+
+
+def _chain(buffered: list, rest, chunks):
+    try:
+        yield from buffered
+        yield from rest
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# Passes chunks through and, once they are exhausted, calls on_complete(body)
+# with all of them joined, unless they added up to more than max_bytes
+def collect(chunks, max_bytes: int, on_complete):
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            collected.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                collected = None
+        yield chunk
+    if collected is not None:
+        on_complete(b"".join(collected))
+
+
+class CompressedDocuments:
+    # LRU of compressed list documents assembled from several cached pages.
+    # Each document remembers (weakly) the cache entries it was built from; it is
+    # only served while all of them are still current.
+    def __init__(self, max_bytes=COMPRESSED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._documents = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evictions": 0}
+
+    def get(self, key, is_current):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+        if document is not None and self._current(document[1], is_current):
+            self._count("hits")
+            return document[0]
+        self._count("misses")
+        return None
+
+    @staticmethod
+    def _current(sources, is_current) -> bool:
+        for source, ref in sources:
+            entry = ref()
+            if entry is None or not is_current(source, entry):
+                return False
+        return True
+
+    def put(self, key, body: bytes, sources: list):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._documents.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._documents[key] = (body, tuple((source, weakref.ref(entry)) for source, entry in sources))
+            self._bytes += len(body)
+            self.stats["stored"] += 1
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._documents.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._documents), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+compressed_documents = CompressedDocuments()
@@ -0,0 +1,155 @@
+import os
+import time
+import sqlite3
+import threading
+
+# SQLite file backing the response cache across restarts; empty disables the disk tier
+DISK_CACHE_PATH = os.getenv("APALEO_DISK_CACHE_PATH", "cache/responses.sqlite3")
+# Total size of bodies kept on disk; least recently used entries are evicted first
+DISK_CACHE_MAX_BYTES = int(os.getenv("APALEO_DISK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    encoding TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+"""
+
+
+class DiskCache:
+    # Persistent tier below the in-memory response cache. Several server processes
+    # on one host can share the file: SQLite serializes the writers (WAL mode) and
+    # readers never block them.
+    def __init__(self, path: str = DISK_CACHE_PATH, max_bytes: int = DISK_CACHE_MAX_BYTES, busy_timeout: float = 10.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {"reads": 0, "hits": 0, "writes": 0, "evictions": 0, "errors": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    # Returns the stored row as (body, encoding, etag, last_modified, expires_at), or None
+    def get(self, key: str):
+        self._count("reads")
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT body, encoding, etag, last_modified, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            self._error("read", e)
+            return None
+        if row is not None:
+            self._count("hits")
+        return row
+
+    def put(self, key: str, body: bytes, encoding: str, etag: str, last_modified: str, expires_at: float):
+        if len(body) > self.max_bytes:
+            return
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, body, encoding, etag, last_modified, expires_at, len(body), time.time()),
+                )
+                evicted = self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._error("write", e)
+            return
+        self._count("writes")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _evict(self, conn) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        return len(victims)
+
+    # Extends the freshness of an entry, e.g. after a 304 Not Modified
+    def touch(self, key: str, expires_at: float):
+        try:
+            self._connect().execute("UPDATE entries SET expires_at = ? WHERE key = ?", (expires_at, key))
+        except sqlite3.Error as e:
+            self._error("write", e)
+
+    def invalidate(self, prefix: str = "", match=None):
+        try:
+            conn = self._connect()
+            if match is None:
+                conn.execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+                return
+            keys = [row[0] for row in conn.execute("SELECT key FROM entries WHERE substr(key, 1, ?) = ?",
+                                                   (len(prefix), prefix))]
+            conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys if match(key)])
+        except sqlite3.Error as e:
+            self._error("write", e)
+
+    # Most recently used entries, newest first, as (key, body, encoding, etag, last_modified, expires_at)
+    def recent(self, max_bytes: int):
+        try:
+            rows = self._connect().execute(
+                "SELECT key, body, encoding, etag, last_modified, expires_at, size FROM entries ORDER BY accessed_at DESC"
+            )
+            total = 0
+            for row in rows:
+                total += row[6]
+                if total > max_bytes:
+                    break
+                yield row[:6]
+        except sqlite3.Error as e:
+            self._error("read", e)
+
+    def _error(self, action: str, error: Exception):
+        self._count("errors")
+        print(f"[ERROR] Disk cache {action} failed: {error}")
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        try:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        return {**stats, "entries": entries, "bytes": size, "max_bytes": self.max_bytes, "path": self.path}
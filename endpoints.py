@@ -0,0 +1,17 @@
+# Local route name -> Apaleo API path and the key holding the item list.
+# "paged" marks list endpoints that accept pageNumber/pageSize,
+# "ttl" is how many seconds a cached response stays fresh.
+ENDPOINTS = {
+    "reservations": {"path": "/booking/v1/reservations", "list_key": "reservations", "paged": True, "ttl": 60},
+    "bookings": {"path": "/booking/v1/bookings", "list_key": "bookings", "paged": True, "ttl": 60},
+    "folios": {"path": "/finance/v1/folios", "list_key": "folios", "paged": True, "ttl": 60},
+    "properties": {"path": "/inventory/v1/properties", "list_key": "properties", "paged": True, "ttl": 3600},
+    "unit-groups": {"path": "/inventory/v1/unit-groups", "list_key": "unitGroups", "paged": True, "ttl": 3600},
+    "units": {"path": "/inventory/v1/units", "list_key": "units", "paged": True, "ttl": 3600},
+    "sources": {"path": "/booking/v1/types/sources", "list_key": "sources", "paged": False, "ttl": 3600},
+    "services": {"path": "/rateplan/v1/services", "list_key": "services", "paged": True, "ttl": 3600},
+    "capture-policies": {"path": "/settings/v1/capture-policies", "list_key": "capturePolicies", "paged": True, "ttl": 3600},
+}
+
+# Per-property settings endpoint, fetched once for every property
+AGE_CATEGORIES = {"path": "/settings/v1/age-categories", "list_key": "ageCategories", "paged": False, "ttl": 3600}
@@ -0,0 +1,388 @@
+import os
+import re
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for identity.apaleo.com and the Apaleo API, serving synthetic data.
+# Items are generated from their index, so any page can be built without holding the dataset.
+
+CURRENCIES = ["EUR", "EUR", "EUR", "GBP", "USD"]
+STATUSES = ["Confirmed", "Confirmed", "InHouse", "CheckedOut", "Canceled", "NoShow"]
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Eva", "Felix", "Greta", "Hans", "Ida", "Jonas"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Hoffmann"]
+CHANNELS = ["Direct", "BookingCom", "Expedia", "Ibe", "ChannelManager"]
+UNIT_GROUP_CODES = ["SGL", "DBL", "TWN", "JST", "STE"]
+EPOCH = date(2024, 1, 1)
+
+
+def _iso(day: date, hour: int = 0) -> str:
+    return datetime(day.year, day.month, day.day, hour, tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class SyntheticData:
+    # Deterministic synthetic Apaleo entities at a given scale
+    def __init__(self, reservations: int = 10000, properties: int = 5, units_per_property: int = 100, seed: int = 1):
+        self.seed = seed
+        self.property_ids = [f"P{i:02d}" for i in range(properties)]
+        self.counts = {
+            "reservations": reservations,
+            "bookings": max(1, reservations // 2),
+            "folios": reservations,
+            "properties": properties,
+            "unitGroups": properties * len(UNIT_GROUP_CODES),
+            "units": properties * units_per_property,
+            "services": properties * 4,
+            "capturePolicies": 3,
+            "sources": len(CHANNELS),
+        }
+        self.units_per_property = units_per_property
+        # (kind, index) -> how often the record was changed via /_touch
+        self.revisions = {}
+
+    def _rng(self, kind: str, i: int) -> random.Random:
+        return random.Random(f"{self.seed}:{kind}:{i}")
+
+    def _modified(self, kind: str, i: int, original: str) -> str:
+        revision = self.revisions.get((kind, i))
+        if not revision:
+            return original
+        return (datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=revision)).isoformat().replace("+00:00", "Z")
+
+    # Marks records as changed; returns the indices that exist
+    def touch(self, kind: str, ids: list) -> list:
+        touched = []
+        for entity_id in ids:
+            i = self.index_of(kind, entity_id)
+            if i is not None:
+                self.revisions[(kind, i)] = self.revisions.get((kind, i), 0) + 1
+                touched.append(i)
+        return touched
+
+    def index_of(self, kind: str, entity_id: str):
+        match = ITEM_IDS[kind].match(entity_id)
+        if not match or int(match.group(1)) >= self.counts[kind + "s"]:
+            return None
+        return int(match.group(1))
+
+    def _property(self, i: int) -> dict:
+        property_id = self.property_ids[i % len(self.property_ids)]
+        return {"id": property_id, "code": property_id, "name": f"Hotel {property_id}", "description": "Synthetic"}
+
+    def reservation(self, i: int) -> dict:
+        rng = self._rng("reservation", i)
+        prop = self._property(i)
+        arrival = EPOCH + timedelta(days=rng.randrange(365))
+        nights = rng.randint(1, 7)
+        currency = CURRENCIES[rng.randrange(len(CURRENCIES))]
+        rate = round(rng.uniform(60, 400), 2)
+        group = UNIT_GROUP_CODES[rng.randrange(len(UNIT_GROUP_CODES))]
+        return {
+            "id": f"RES{i:08d}-1",
+            "bookingId": f"BKG{i // 2:08d}",
+            "status": STATUSES[rng.randrange(len(STATUSES))],
+            "property": prop,
+            "ratePlan": {"id": f"{prop['id']}-NONREF-{group}", "code": "NONREF", "name": "Non refundable"},
+            "unitGroup": {"id": f"{prop['id']}-{group}", "code": group, "name": group, "type": "BedRoom"},
+            "unit": {"id": f"{prop['id']}-U{rng.randrange(self.units_per_property):04d}"},
+            "totalGrossAmount": {"amount": round(rate * nights, 2), "currency": currency},
+            "arrival": _iso(arrival, 15),
+            "departure": _iso(arrival + timedelta(days=nights), 11),
+            "created": _iso(arrival - timedelta(days=rng.randint(1, 120)), 9),
+            "modified": self._modified("reservation", i, _iso(arrival - timedelta(days=rng.randint(0, 1)), 10)),
+            "adults": rng.randint(1, 3),
+            "childrenAges": [rng.randint(0, 12) for _ in range(rng.randint(0, 2))],
+            "channelCode": CHANNELS[rng.randrange(len(CHANNELS))],
+            "primaryGuest": {
+                "firstName": FIRST_NAMES[rng.randrange(len(FIRST_NAMES))],
+                "lastName": LAST_NAMES[rng.randrange(len(LAST_NAMES))],
+                "address": {"countryCode": rng.choice(["DE", "AT", "GB", "US"])},
+            },
+            "timeSlices": [
+                {
+                    "from": _iso(arrival + timedelta(days=n), 15),
+                    "to": _iso(arrival + timedelta(days=n + 1), 11),
+                    "totalGrossAmount": {"amount": rate, "currency": currency},
+                }
+                for n in range(nights)
+            ],
+            "balance": {"amount": round(-rate * rng.random(), 2), "currency": currency},
+        }
+
+    def folio(self, i: int) -> dict:
+        rng = self._rng("folio", i)
+        prop = self._property(i)
+        currency = CURRENCIES[rng.randrange(len(CURRENCIES))]
+        created = EPOCH + timedelta(days=rng.randrange(365))
+        charges = [
+            {"id": f"F{i:08d}-C{n}", "name": rng.choice(["Accommodation", "Breakfast", "Parking", "Minibar"]),
+             "amount": {"grossAmount": round(rng.uniform(5, 300), 2), "currency": currency}}
+            for n in range(rng.randint(1, 4))
+        ]
+        return {
+            "id": f"RES{i:08d}-1-1",
+            "type": "Guest",
+            "property": prop,
+            "reservation": {"id": f"RES{i:08d}-1"},
+            "created": _iso(created, 12),
+            "updated": self._modified("folio", i, _iso(created + timedelta(days=rng.randint(0, 10)), 12)),
+            "isMainFolio": True,
+            "status": rng.choice(["Open", "Closed"]),
+            "balance": {"amount": round(rng.uniform(-500, 500), 2), "currency": currency},
+            "charges": charges,
+        }
+
+    def booking(self, i: int) -> dict:
+        rng = self._rng("booking", i)
+        return {
+            "id": f"BKG{i:08d}",
+            "booker": {"firstName": FIRST_NAMES[rng.randrange(len(FIRST_NAMES))],
+                       "lastName": LAST_NAMES[rng.randrange(len(LAST_NAMES))]},
+            "created": _iso(EPOCH + timedelta(days=rng.randrange(365)), 8),
+            "reservations": [{"id": f"RES{2 * i + n:08d}-1"} for n in range(2)],
+        }
+
+    def property_item(self, i: int) -> dict:
+        return {**self._property(i), "currencyCode": "EUR", "timeZone": "Europe/Berlin", "status": "Live"}
+
+    def unit_group(self, i: int) -> dict:
+        prop = self._property(i // len(UNIT_GROUP_CODES))
+        code = UNIT_GROUP_CODES[i % len(UNIT_GROUP_CODES)]
+        return {"id": f"{prop['id']}-{code}", "code": code, "name": code, "memberCount": self.units_per_property // len(UNIT_GROUP_CODES),
+                "maxPersons": 1 + i % 4, "type": "BedRoom", "property": prop}
+
+    def unit(self, i: int) -> dict:
+        rng = self._rng("unit", i)
+        prop = self._property(i // self.units_per_property)
+        code = UNIT_GROUP_CODES[i % len(UNIT_GROUP_CODES)]
+        return {
+            "id": f"{prop['id']}-U{i % self.units_per_property:04d}",
+            "name": str(100 + i % self.units_per_property),
+            "property": prop,
+            "unitGroup": {"id": f"{prop['id']}-{code}", "code": code},
+            "status": {"isOccupied": rng.random() < 0.7, "condition": rng.choice(["Clean", "Dirty", "CleanToBeInspected"])},
+            "maxPersons": 1 + i % 4,
+        }
+
+    def service(self, i: int) -> dict:
+        prop = self._property(i // 4)
+        return {"id": f"{prop['id']}-SRV{i % 4}", "name": ["Breakfast", "Parking", "Late checkout", "Pet"][i % 4],
+                "property": prop, "defaultGrossPrice": {"amount": 10.0 + i % 4 * 5, "currency": "EUR"}}
+
+    def capture_policy(self, i: int) -> dict:
+        return {"id": f"CP{i}", "code": ["NONE", "FULL", "FIRST_NIGHT"][i % 3], "name": "Capture policy"}
+
+    def source(self, i: int) -> dict:
+        return {"code": CHANNELS[i], "name": CHANNELS[i]}
+
+    def age_categories(self, property_id: str) -> list:
+        return [
+            {"id": f"{property_id}-BABY", "code": "BABY", "name": "Baby", "minAge": 0, "maxAge": 2, "propertyId": property_id},
+            {"id": f"{property_id}-CHILD", "code": "CHILD", "name": "Child", "minAge": 3, "maxAge": 12, "propertyId": property_id},
+        ]
+
+
+# Apaleo path -> (list key, item builder name)
+ROUTES = {
+    "/booking/v1/reservations": ("reservations", "reservation"),
+    "/booking/v1/bookings": ("bookings", "booking"),
+    "/finance/v1/folios": ("folios", "folio"),
+    "/inventory/v1/properties": ("properties", "property_item"),
+    "/inventory/v1/unit-groups": ("unitGroups", "unit_group"),
+    "/inventory/v1/units": ("units", "unit"),
+    "/booking/v1/types/sources": ("sources", "source"),
+    "/rateplan/v1/services": ("services", "service"),
+    "/settings/v1/capture-policies": ("capturePolicies", "capture_policy"),
+}
+
+
+# Single records served under <list path>/<id>
+ITEM_ROUTES = {"/booking/v1/reservations/": "reservation", "/finance/v1/folios/": "folio"}
+ITEM_IDS = {"reservation": re.compile(r"^RES(\d{8})-1$"), "folio": re.compile(r"^RES(\d{8})-1-1$")}
+
+
+class FakeApaleo:
+    # Serves the token endpoint and the list endpoints above with paging, property
+    # filters, gzip, ETags and an injected latency per request.
+    def __init__(self, data: SyntheticData, latency: float = 0.0, jitter: float = 0.0, max_page_size: int = 1000,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.stats = {"token_requests": 0, "api_requests": 0, "not_modified": 0, "bytes_sent": 0}
+        self._stats_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-apaleo", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _indices(self, list_key: str, query: dict) -> range:
+        total = self.data.counts[list_key]
+        property_ids = query.get("propertyIds", query.get("propertyId", [""]))[0]
+        if property_ids and list_key in ("reservations", "folios"):
+            # Items of property k are the indices k, k + P, k + 2P, ...
+            wanted = [self.data.property_ids.index(p) for p in property_ids.split(",") if p in self.data.property_ids]
+            count = len(self.data.property_ids)
+            return sorted(i for k in wanted for i in range(k, total, count))
+        if property_ids and list_key in ("units", "unitGroups", "services"):
+            per_property = total // len(self.data.property_ids)
+            wanted = [self.data.property_ids.index(p) for p in property_ids.split(",") if p in self.data.property_ids]
+            return [i for k in sorted(wanted) for i in range(k * per_property, (k + 1) * per_property)]
+        return range(total)
+
+    def page(self, path: str, query: dict):
+        # (status, body object) for an API request
+        if path == "/settings/v1/age-categories":
+            property_id = query.get("propertyId", [""])[0]
+            if property_id not in self.data.property_ids:
+                return 404, {"messages": [f"Property '{property_id}' not found"]}
+            items = self.data.age_categories(property_id)
+            return 200, {"ageCategories": items, "count": len(items)}
+        for prefix, kind in ITEM_ROUTES.items():
+            if path.startswith(prefix):
+                i = self.data.index_of(kind, path[len(prefix):])
+                if i is None:
+                    return 404, {"messages": [f"{kind} not found"]}
+                return 200, getattr(self.data, kind)(i)
+        if path not in ROUTES:
+            return 404, {"messages": ["Not found"]}
+        list_key, builder = ROUTES[path]
+        indices = self._indices(list_key, query)
+        total = len(indices)
+        if "pageSize" in query:
+            page_size = int(query["pageSize"][0])
+            if page_size > self.max_page_size:
+                return 400, {"messages": [f"pageSize must not exceed {self.max_page_size}"]}
+            page_number = int(query.get("pageNumber", ["1"])[0])
+            indices = indices[(page_number - 1) * page_size:page_number * page_size]
+        if not indices:
+            return 204, None
+        build = getattr(self.data, builder)
+        items = [build(i) for i in indices]
+        status = query.get("status", [""])[0]
+        if status and list_key == "reservations":
+            items = [item for item in items if item["status"] in status.split(",")]
+        return 200, {list_key: items, "count": total}
+
+    def _handler_class(self):
+        fake = self
+
+        @lru_cache(maxsize=64)
+        def encoded(path, query_key):
+            status, body = fake.page(path, {k: list(v) for k, v in query_key})
+            raw = b"" if body is None else json.dumps(body).encode("utf-8")
+            return status, raw, gzip.compress(raw, 5) if raw else b"", f'"{hashlib.md5(raw).hexdigest()}"'
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body: bytes, headers: dict = None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.count("bytes_sent", len(body))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if urlparse(self.path).path == "/_touch":
+                    # {"kind": "reservation", "ids": [...]}: change records, e.g. before replaying webhooks
+                    request = json.loads(body)
+                    touched = fake.data.touch(request["kind"], request["ids"])
+                    encoded.cache_clear()
+                    self._send(200, json.dumps({"touched": len(touched)}).encode(), {"Content-Type": "application/json"})
+                    return
+                if urlparse(self.path).path != "/connect/token":
+                    self._send(404, b"")
+                    return
+                fake.count("token_requests")
+                body = json.dumps({"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600}).encode()
+                self._send(200, body, {"Content-Type": "application/json"})
+
+            def do_GET(self):
+                if self.path == "/_stats":
+                    with fake._stats_lock:
+                        body = json.dumps(fake.stats).encode()
+                    self._send(200, body, {"Content-Type": "application/json"})
+                    return
+                fake.count("api_requests")
+                if fake.latency or fake.jitter:
+                    time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    self._send(401, b"")
+                    return
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                query_key = tuple(sorted((k, tuple(v)) for k, v in query.items()))
+                status, raw, compressed, etag = encoded(parsed.path, query_key)
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    fake.count("not_modified")
+                    self._send(304, b"", {"ETag": etag})
+                    return
+                headers = {"Content-Type": "application/json"}
+                if status == 200:
+                    headers["ETag"] = etag
+                if raw and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    headers["Content-Encoding"] = "gzip"
+                    raw = compressed
+                self._send(status, raw, headers)
+
+        return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local fake of the Apaleo identity server and API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_APALEO_PORT", "9000")))
+    parser.add_argument("--reservations", type=int, default=10000, help="Number of reservations (and folios)")
+    parser.add_argument("--properties", type=int, default=5)
+    parser.add_argument("--units-per-property", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency of up to this many seconds")
+    parser.add_argument("--max-page-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = SyntheticData(args.reservations, args.properties, args.units_per_property, args.seed)
+    fake = FakeApaleo(data, args.latency, args.jitter, args.max_page_size, args.host, args.port)
+    print(f"Fake Apaleo at {fake.url} (APALEO_BASE_URL={fake.url} APALEO_TOKEN_URL={fake.url}/connect/token)", flush=True)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
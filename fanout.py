@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_client
+from endpoints import ENDPOINTS
+
+# Max upstream requests in flight for one fan-out
+FANOUT_WORKERS = int(os.getenv("APALEO_FANOUT_WORKERS", "8"))
+# Seconds the property list driving per-property fan-outs is reused
+PROPERTY_LIST_TTL = int(os.getenv("APALEO_PROPERTY_LIST_TTL", "3600"))
+
+
+# Runs fetch(key) for every key with bounded concurrency.
+# Returns ({key: result}, {key: error message}); one failing key never fails the others.
+def fan_out(keys, fetch, max_workers: int = FANOUT_WORKERS):
+    results = {}
+    errors = {}
+    if not keys:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as pool:
+        futures = {pool.submit(contextvars.copy_context().run, fetch, key): key for key in keys}
+        # Merge results in completion order, so one slow key does not hold up the rest
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = str(e)
+    return results, errors
+
+
+class PropertyList:
+    # Cached list of property IDs; concurrent callers share one refresh
+    def __init__(self, ttl=PROPERTY_LIST_TTL):
+        self.ttl = ttl
+        self._ids = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, fetch_json=None) -> list:
+        if self._ids is not None and time.time() < self._fetched_at + self.ttl:
+            return self._ids
+        with self._lock:
+            if self._ids is None or time.time() >= self._fetched_at + self.ttl:
+                endpoint = ENDPOINTS["properties"]
+                data = http_client.fetch_all_pages(endpoint["path"], endpoint["list_key"], fetch_json=fetch_json)
+                self._ids = [p["id"] for p in data.get(endpoint["list_key"], []) if p.get("id")]
+                self._fetched_at = time.time()
+            return self._ids
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+
+property_list = PropertyList()
+
+
+# Fetches a per-property endpoint (e.g. age categories) for many properties concurrently.
+# Returns (items stamped with their propertyId, {propertyId: error message}).
+def fetch_per_property(endpoint: dict, property_ids: list = None, fetch_json=None, max_workers: int = FANOUT_WORKERS):
+    if fetch_json is None:
+        def fetch_json(relative_path, params):
+            return http_client.read_json(http_client.get(relative_path, params=params))
+    if not property_ids:
+        property_ids = property_list.get(fetch_json)
+
+    def fetch(property_id):
+        return fetch_json(endpoint["path"], {"propertyId": property_id}).get(endpoint["list_key"], [])
+
+    results, errors = fan_out(property_ids, fetch, max_workers)
+    items = []
+    for property_id in property_ids:
+        for item in results.get(property_id, []):
+            item["propertyId"] = item.get("propertyId", property_id)
+            items.append(item)
+    return items, errors
@@ -0,0 +1,91 @@
+import os
+import json
+import polars as pl
+
+# Nested fields pulled into flat columns per endpoint: {column: "path.to.field"}
+FLATTEN_PATHS = {
+    "reservations": {
+        "property_id": "property.id",
+        "rate_plan_id": "ratePlan.id",
+        "unit_group_id": "unitGroup.id",
+        "total_amount": "totalGrossAmount.amount",
+        "total_currency": "totalGrossAmount.currency",
+    },
+    "bookings": {"booker_last_name": "booker.lastName"},
+    "folios": {
+        "property_id": "property.id",
+        "amount": "balance.amount",
+        "currency": "balance.currency",
+    },
+    "units": {
+        "property_id": "property.id",
+        "unit_group_id": "unitGroup.id",
+        "is_occupied": "status.isOccupied",
+        "condition": "status.condition",
+    },
+    "unit-groups": {"property_id": "property.id"},
+    "services": {"property_id": "property.id"},
+}
+
+# Conversion rates to EUR, overridable with APALEO_CURRENCY_RATES='{"GBP": 1.17, ...}'
+CURRENCY_RATES = {"EUR": 1.0, "GBP": 1.15, "USD": 0.85}
+CURRENCY_RATES.update(json.loads(os.getenv("APALEO_CURRENCY_RATES", "{}")))
+
+
+def _resolve(schema, path: str):
+    # The dtype at a dotted path, or None if the path does not exist in the schema
+    dtype = None
+    fields = dict(schema)
+    for part in path.split("."):
+        if fields is None or part not in fields:
+            return None
+        dtype = fields[part]
+        fields = {f.name: f.dtype for f in dtype.fields} if isinstance(dtype, pl.Struct) else None
+    return dtype
+
+
+# Expression for a dotted path, e.g. field("status.isOccupied")
+def field(path: str) -> pl.Expr:
+    column, *names = path.split(".")
+    expr = pl.col(column)
+    for name in names:
+        expr = expr.struct.field(name)
+    return expr
+
+
+# Adds the declared nested paths as native columns. Paths missing from the schema
+# (e.g. a field never seen in the sample) become null columns instead of failing.
+def flatten(df, paths: dict):
+    schema = df.collect_schema() if isinstance(df, pl.LazyFrame) else df.schema
+    columns = []
+    for alias, path in paths.items():
+        if _resolve(schema, path) is None:
+            columns.append(pl.lit(None).alias(alias))
+        else:
+            columns.append(field(path).alias(alias))
+    return df.with_columns(columns)
+
+
+def normalize(name: str, df):
+    return flatten(df, FLATTEN_PATHS.get(name, {}))
+
+
+# Maps a column through a lookup table inside the engine; unknown keys get the default
+def lookup(column: str, table: dict, default=None, dtype=pl.Float64) -> pl.Expr:
+    return pl.col(column).replace_strict(table, default=default, return_dtype=dtype)
+
+
+# Joins a lookup table given as a DataFrame, e.g. rates per currency and day
+def join_lookup(df, table: pl.DataFrame, on, how: str = "left"):
+    if isinstance(df, pl.LazyFrame):
+        table = table.lazy()
+    return df.join(table, on=on, how=how)
+
+
+# Adds conversion_rate and amount_eur; currencies without a rate keep their amount (rate 1.0)
+def to_eur(df, amount: str = "amount", currency: str = "currency", rates: dict = None):
+    rate = lookup(currency, rates or CURRENCY_RATES, default=1.0)
+    return df.with_columns([
+        rate.alias("conversion_rate"),
+        (pl.col(amount) * rate).alias("amount_eur"),
+    ])
@@ -0,0 +1,61 @@
+import io
+import json
+import polars as pl
+
+# Output formats of the data routes and their media types
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+_ACCEPT_ALIASES = {
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.file": "arrow",
+    "application/jsonl": "ndjson",
+}
+
+
+# Picks the output format from ?format=... or else the Accept header; JSON by default
+def negotiate_format(query: dict, accept: str = "") -> str:
+    requested = (query.get("format") or [""])[0].lower()
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown format '{requested}', expected one of: {', '.join(FORMATS)}")
+        return requested
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        for name, known in FORMATS.items():
+            if media_type == known:
+                return name
+        if media_type in _ACCEPT_ALIASES:
+            return _ACCEPT_ALIASES[media_type]
+    return "json"
+
+
+def ndjson_lines(items: list) -> bytes:
+    if not items:
+        return b""
+    return ("\n".join(json.dumps(item) for item in items) + "\n").encode("utf-8")
+
+
+# Serializes a DataFrame as an Arrow IPC stream or Parquet file
+def dataframe_to_bytes(df: pl.DataFrame, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "arrow":
+        df.write_ipc_stream(buffer)
+    elif fmt == "parquet":
+        df.write_parquet(buffer)
+    else:
+        raise ValueError(f"Format '{fmt}' is not a binary table format")
+    return buffer.getvalue()
+
+
+# Writes a DataFrame in the format given by the file extension (.csv, .parquet, .arrow/.ipc)
+def write_table(df: pl.DataFrame, path: str):
+    if path.endswith(".parquet"):
+        df.write_parquet(path)
+    elif path.endswith((".arrow", ".ipc", ".feather")):
+        df.write_ipc(path)
+    else:
+        df.write_csv(path)
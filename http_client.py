@@ -0,0 +1,279 @@
+import os
+import math
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from dotenv import load_dotenv
+import metrics
+from auth import get_access_token, invalidate_token
+from endpoints import ENDPOINTS, AGE_CATEGORIES
+from rate_limiter import rate_limiter, parse_retry_after, backoff_delay, MAX_RETRIES
+
+load_dotenv()
+BASE_URL = os.getenv("APALEO_BASE_URL")
+# Max keep-alive connections kept open per upstream host
+POOL_SIZE = int(os.getenv("APALEO_POOL_SIZE", "10"))
+# Seconds to wait for the TCP/TLS handshake and between two bytes of the response
+CONNECT_TIMEOUT = float(os.getenv("APALEO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("APALEO_READ_TIMEOUT", "60"))
+# Items per upstream page and how many pages are fetched in parallel
+PAGE_SIZE = int(os.getenv("APALEO_PAGE_SIZE", "500"))
+PAGE_WORKERS = int(os.getenv("APALEO_PAGE_WORKERS", "4"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Connections that report how long opening them took (TCP and TLS handshake)
+class _TimedConnectionMixin:
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            metrics.upstream_connections.inc()
+            metrics.add_phase("connect", time.perf_counter() - started)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+def build_session(pool_size=POOL_SIZE):
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+# One pooled session shared by every upstream call
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+# GET an Apaleo API path with auth, timeouts and the shared connection pool.
+# Every call goes through the shared rate limiter; 429s are retried with
+# jittered exponential backoff, honouring Retry-After. A 401 drops the token
+# and is retried once with a new one.
+def get(relative_path: str, params: dict = None, token: str = None, stream: bool = False, headers: dict = None):
+    if not token:
+        with metrics.phase("token"):
+            token = get_access_token()
+    request_headers = {"Authorization": f"Bearer {token}"}
+    if headers:
+        request_headers.update(headers)
+    attempt = 0
+    reauthorized = False
+    while True:
+        with metrics.phase("limiter"):
+            rate_limiter.acquire()
+        metrics.upstream_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            response = get_session().get(
+                f"{BASE_URL}{relative_path}",
+                params=params,
+                headers=request_headers,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                stream=stream,
+            )
+        except Exception:
+            rate_limiter.release()
+            metrics.upstream_total.inc(path_label(relative_path), "error")
+            raise
+        finally:
+            metrics.upstream_in_flight.dec()
+        _observe_upstream(relative_path, response, time.perf_counter() - started, stream)
+        throttled = response.status_code == 429
+        rate_limiter.release(throttled)
+        if response.status_code == 401 and not reauthorized:
+            # The token was revoked or expired early
+            reauthorized = True
+            response.close()
+            invalidate_token(token)
+            with metrics.phase("token"):
+                token = get_access_token()
+            request_headers["Authorization"] = f"Bearer {token}"
+            continue
+        if not throttled or attempt >= MAX_RETRIES:
+            break
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = backoff_delay(attempt)
+        response.close()
+        rate_limiter.pause(delay)
+        attempt += 1
+    response.raise_for_status()
+    return response
+
+
+# Registered Apaleo paths; metrics label everything else with a template so that
+# item paths like /finance/v1/folios/<id> do not add one series per id
+UPSTREAM_PATHS = {endpoint["path"] for endpoint in ENDPOINTS.values()} | {AGE_CATEGORIES["path"]}
+
+
+def path_label(relative_path: str) -> str:
+    path = "/" + relative_path.split("?")[0].strip("/")
+    if path in UPSTREAM_PATHS:
+        return path
+    parent = path.rsplit("/", 1)[0]
+    if parent in UPSTREAM_PATHS:
+        return parent + "/{id}"
+    return "other"
+
+
+def _observe_upstream(relative_path: str, response, seconds: float, stream: bool):
+    relative_path = path_label(relative_path)
+    metrics.add_phase("upstream", seconds)
+    metrics.upstream_seconds.observe(seconds, relative_path)
+    metrics.upstream_total.inc(relative_path, response.status_code)
+    if not stream:
+        metrics.upstream_bytes.inc(relative_path, amount=response.raw.tell())
+        return
+    # Streamed bodies are read later; count what was received when the response is closed
+    close = response.close
+
+    def close_and_count():
+        if response.raw is not None:
+            metrics.upstream_bytes.inc(relative_path, amount=response.raw.tell())
+        close()
+        response.close = close
+
+    response.close = close_and_count
+
+
+# Apaleo answers 204 No Content for empty lists
+def read_json(response):
+    if response.status_code == 204 or not response.content:
+        return {}
+    return response.json()
+
+
+# Yields the parsed body of every page of a list endpoint, in page order.
+# The first page tells us the total count; the rest are fetched concurrently,
+# at most max_workers pages ahead of the consumer.
+# fetch_json(relative_path, params) can replace the plain GET, e.g. to go through a cache.
+# With stream, pages are only opened ahead (status and headers); each body is read with
+# read_page(response) on the caller's thread when the page is due, e.g. parsed while it downloads.
+# read_page may return the items as an iterator that parses them while they are consumed; they
+# must then be consumed before the next page is requested, which is only opened after the
+# first page told its count.
+def iter_pages(relative_path: str, list_key: str, params: dict = None, token: str = None,
+               page_size: int = PAGE_SIZE, max_workers: int = PAGE_WORKERS, fetch_json=None,
+               stream: bool = False, read_page=read_json):
+    params = dict(params or {})
+    if fetch_json is None:
+        token = token or get_access_token()
+
+        def fetch_json(path, page_params):
+            if stream:
+                return get(path, params=page_params, token=token, stream=True)
+            return read_json(get(path, params=page_params, token=token))
+
+    def fetch_page(page_number):
+        page_params = {**params, "pageNumber": page_number, "pageSize": page_size}
+        return fetch_json(relative_path, page_params)
+
+    def read(opened):
+        return read_page(opened) if stream else opened
+
+    first = read(fetch_page(1))
+    items = first.get(list_key, [])
+    lazy = not isinstance(items, list)
+    if lazy:
+        first_size = 0
+
+        def counted(items):
+            nonlocal first_size
+            for item in items:
+                first_size += 1
+                yield item
+
+        first[list_key] = counted(items)
+        yield first
+    else:
+        first_size = len(items)
+    total = first.get("count", first_size)
+    # Endpoints that ignore paging return everything on the first page
+    if first_size >= total or first_size > page_size:
+        if not lazy:
+            yield first
+        return
+
+    page_count = math.ceil(total / page_size)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, page_count - 1))) as pool:
+        pending = deque()
+        next_page = 2
+
+        # Keeps up to max_workers pages in flight, also while the caller handles a page
+        def fill():
+            nonlocal next_page
+            while next_page <= page_count and len(pending) < max_workers:
+                # Run in a copy of the caller's context, so per-request timings include the page
+                pending.append(pool.submit(contextvars.copy_context().run, fetch_page, next_page))
+                next_page += 1
+
+        try:
+            fill()
+            if not lazy:
+                yield first
+            while pending:
+                opened = pending.popleft().result()
+                fill()
+                yield read(opened)
+        finally:
+            for future in pending:
+                if not future.cancel() and stream:
+                    # Already opened: release the connection
+                    try:
+                        future.result().close()
+                    except Exception:
+                        pass
+
+
+# Fetches every page of a list endpoint and merges the items
+def fetch_all_pages(relative_path: str, list_key: str, params: dict = None, token: str = None,
+                    page_size: int = PAGE_SIZE, max_workers: int = PAGE_WORKERS, fetch_json=None) -> dict:
+    items = []
+    total = 0
+    pages = iter_pages(relative_path, list_key, params, token, page_size, max_workers, fetch_json)
+    for page_number, page in enumerate(pages):
+        if page_number == 0:
+            total = page.get("count", 0)
+        items.extend(page.get(list_key, []))
+    return {list_key: items, "count": max(total, len(items))}
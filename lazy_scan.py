@@ -0,0 +1,218 @@
+import io
+import json
+from datetime import date, timedelta
+import polars as pl
+from polars.io.plugins import register_io_source
+import http_client
+from endpoints import ENDPOINTS
+from schema_utils import get_schema, rows_to_df, SCHEMA_SAMPLE_ROWS
+
+# Filters that can be pushed into Apaleo query parameters, per endpoint.
+# "in" filters map a column (or struct field) to a comma-separated list parameter,
+# "single" filters only push down when exactly one value is requested,
+# "date_ranges" map a date column to Apaleo's dateFilter/from/to.
+PUSHDOWN = {
+    "reservations": {
+        "in": {"property.id": "propertyIds", "status": "status"},
+        "date_ranges": {"arrival": "Arrival", "departure": "Departure"},
+    },
+    "bookings": {"in": {"property.id": "propertyIds"}},
+    "folios": {"in": {"property.id": "propertyIds"}},
+    "units": {"single": {"property.id": "propertyId"}},
+    "unit-groups": {"single": {"property.id": "propertyId"}},
+    "services": {"single": {"property.id": "propertyId"}},
+}
+
+_FLIPPED = {"Lt": "Gt", "LtEq": "GtEq", "Gt": "Lt", "GtEq": "LtEq", "Eq": "Eq"}
+
+
+def _column_name(node):
+    # "col" or "col.field" for pl.col(col).struct.field(field), else None
+    if not isinstance(node, dict):
+        return None
+    if "Column" in node:
+        return node["Column"]
+    function = node.get("Function")
+    if function and function.get("function", {}).get("StructExpr", {}).get("FieldByName"):
+        parent = _column_name(function["input"][0])
+        if parent:
+            return f"{parent}.{function['function']['StructExpr']['FieldByName']}"
+    return None
+
+
+def _literal(node):
+    scalar = node.get("Literal", {}).get("Scalar") if isinstance(node, dict) else None
+    if not scalar:
+        return None
+    value = scalar["value"]
+    if "String" in value:
+        return value["String"]
+    if "List" in value:
+        # List literals are serialized as an Arrow IPC stream
+        try:
+            return pl.read_ipc_stream(io.BytesIO(bytes(value["List"]))).to_series().to_list()
+        except Exception:
+            return None
+    return None
+
+
+def _merge(a: dict, b: dict) -> dict:
+    merged = dict(a)
+    for column, (kind, value) in b.items():
+        if column not in merged:
+            merged[column] = (kind, value)
+        elif kind == "in" and merged[column][0] == "in":
+            merged[column] = ("in", merged[column][1] & value)
+        elif kind == "range" and merged[column][0] == "range":
+            low_a, high_a = merged[column][1]
+            low_b, high_b = value
+            low = max(filter(None, [low_a, low_b]), default=None)
+            high = min(filter(None, [high_a, high_b]), default=None)
+            merged[column] = ("range", (low, high))
+    return merged
+
+
+# Extracts pushable constraints from a Polars predicate: {column: ("in", set) | ("range", (low, high))}.
+# Only AND-ed comparisons against string literals are recognized; anything else yields no constraint,
+# which is always safe because the full predicate is applied locally as well.
+def extract_filters(node) -> dict:
+    if isinstance(node, pl.Expr):
+        try:
+            node = json.loads(node.meta.serialize(format="json"))
+        except Exception:
+            return {}
+    if not isinstance(node, dict):
+        return {}
+    binary = node.get("BinaryExpr")
+    if binary:
+        op = binary["op"]
+        if op in ("And", "LogicalAnd"):
+            return _merge(extract_filters(binary["left"]), extract_filters(binary["right"]))
+        column, value = _column_name(binary["left"]), _literal(binary["right"])
+        if column is None:
+            column, value = _column_name(binary["right"]), _literal(binary["left"])
+            op = _FLIPPED.get(op)
+        if column is None or not isinstance(value, str):
+            return {}
+        if op == "Eq":
+            return {column: ("in", {value})}
+        if op in ("Gt", "GtEq"):
+            return {column: ("range", (value, None))}
+        if op in ("Lt", "LtEq"):
+            return {column: ("range", (None, value))}
+        return {}
+    function = node.get("Function")
+    if function and "IsIn" in function.get("function", {}).get("Boolean", {}):
+        column, values = _column_name(function["input"][0]), _literal(function["input"][1])
+        if column and isinstance(values, list):
+            return {column: ("in", {v for v in values if v is not None})}
+    return {}
+
+
+def _widen(value: str, days: int):
+    # Apaleo compares dates in the property's time zone; a one-day margin keeps the
+    # upstream result a superset of what the local filter keeps
+    try:
+        return (date.fromisoformat(value[:10]) + timedelta(days=days)).isoformat() + "T00:00:00Z"
+    except ValueError:
+        return None
+
+
+# Translates extracted constraints into Apaleo query parameters for an endpoint
+def pushdown_params(name: str, filters: dict) -> dict:
+    rules = PUSHDOWN.get(name, {})
+    params = {}
+    for column, (kind, value) in filters.items():
+        if kind == "in" and column in rules.get("in", {}) and value:
+            params[rules["in"][column]] = ",".join(sorted(value))
+        elif kind == "in" and column in rules.get("single", {}) and len(value) == 1:
+            params[rules["single"][column]] = next(iter(value))
+        elif kind == "range" and column in rules.get("date_ranges", {}) and "dateFilter" not in params:
+            low, high = value
+            low = _widen(low, -1) if low else None
+            high = _widen(high, 1) if high else None
+            if low or high:
+                params["dateFilter"] = rules["date_ranges"][column]
+                if low:
+                    params["from"] = low
+                if high:
+                    params["to"] = high
+    return params
+
+
+# Lazily scans a registered endpoint. Filters on recognized columns (from .filter() or the
+# explicit params) become Apaleo query parameters, so only matching rows are fetched;
+# the full predicate and the column selection are still applied locally.
+def scan_endpoint(name: str, params: dict = None) -> pl.LazyFrame:
+    endpoint = ENDPOINTS[name]
+    base_params = dict(params or {})
+
+    def item_schema():
+        sample = {"pageNumber": 1, "pageSize": SCHEMA_SAMPLE_ROWS} if endpoint["paged"] else None
+        return get_schema(endpoint["path"], list_key=endpoint["list_key"], params=sample)[endpoint["list_key"]][0]
+
+    def polars_schema():
+        return rows_to_df([], item_schema()).schema
+
+    def source(with_columns, predicate, n_rows, batch_size):
+        pushed = pushdown_params(name, extract_filters(predicate)) if predicate is not None else {}
+        if "dateFilter" in base_params:
+            for key in ("dateFilter", "from", "to"):
+                pushed.pop(key, None)
+        query = {**pushed, **base_params}
+        schema = item_schema()
+        declared = rows_to_df([], schema).schema
+        if endpoint["paged"]:
+            pages = http_client.iter_pages(endpoint["path"], endpoint["list_key"], params=query)
+        else:
+            pages = iter([http_client.read_json(http_client.get(endpoint["path"], params=query))])
+        remaining = n_rows
+        for page in pages:
+            rows = page.get(endpoint["list_key"], [])
+            if not rows:
+                continue
+            df = rows_to_df(rows, schema)
+            # The scan promised the declared dtypes, so a drifted column is an error
+            # rather than a value silently cast back; unknown keys are left out
+            drifted = [key for key, dtype in declared.items() if df.schema[key] != dtype]
+            if drifted:
+                raise pl.exceptions.SchemaError(f"{name}: columns no longer match the inferred schema: {', '.join(drifted)}")
+            df = df.select(declared.names())
+            if predicate is not None:
+                df = df.filter(predicate)
+            if with_columns is not None:
+                df = df.select(with_columns)
+            if remaining is not None:
+                df = df.head(remaining)
+                remaining -= df.height
+            yield df
+            if remaining is not None and remaining <= 0:
+                return
+
+    return register_io_source(source, schema=polars_schema)
+
+
+def scan_reservations(property_ids: list = None, status: list = None, arrival_from: str = None, arrival_to: str = None,
+                      departure_from: str = None, departure_to: str = None, expand: list = None) -> pl.LazyFrame:
+    params = {}
+    if property_ids:
+        params["propertyIds"] = ",".join(property_ids)
+    if status:
+        params["status"] = ",".join(status)
+    # Apaleo filters on one date field only: arrival if given, else departure
+    ranges = {column: ("range", (low, high))
+              for column, low, high in (("arrival", arrival_from, arrival_to), ("departure", departure_from, departure_to))
+              if low or high}
+    params.update(pushdown_params("reservations", ranges))
+    if expand:
+        params["expand"] = ",".join(expand)
+    lf = scan_endpoint("reservations", params)
+    # The pushed range is widened and covers one field, so both are applied locally,
+    # per day with inclusive bounds
+    for column, (_, (low, high)) in ranges.items():
+        day = pl.col(column).str.slice(0, 10)
+        if low:
+            lf = lf.filter(day >= low[:10])
+        if high:
+            lf = lf.filter(day <= high[:10])
+    return lf
@@ -0,0 +1,192 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    def __init__(self, name: str, help_text: str, kind: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, "counter", labels)
+        if not self.labels:
+            self._values[()] = 0
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, k)} {v}" for k, v in values]
+
+
+class Gauge(Metric):
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, "gauge", labels)
+        if not self.labels:
+            self._values[()] = 0
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, k)} {v}" for k, v in values]
+
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, "histogram", labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket counts (non-cumulative), sum, count
+                series = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = self.header()
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+requests_total = Counter("connector_requests_total", "Requests handled, by route and status code", ("route", "status"))
+request_seconds = Histogram("connector_request_duration_seconds", "Time to handle a request, by route", ("route",))
+request_upstream_seconds = Histogram("connector_request_upstream_seconds",
+                                     "Upstream time spent per request (summed over parallel calls)", ("route",))
+requests_in_flight = Gauge("connector_requests_in_flight", "Requests being handled")
+requests_rejected = Counter("connector_requests_rejected_total", "Connections answered with 503 because all workers were busy")
+upstream_total = Counter("connector_upstream_requests_total", "Upstream requests, by Apaleo path and status code",
+                         ("path", "status"))
+upstream_seconds = Histogram("connector_upstream_duration_seconds", "Time until upstream response headers, by Apaleo path",
+                             ("path",))
+upstream_bytes = Counter("connector_upstream_bytes_total", "Body bytes received from upstream (as sent, e.g. compressed)",
+                         ("path",))
+upstream_connections = Counter("connector_upstream_connections_total", "New connections opened to upstream")
+upstream_in_flight = Gauge("connector_upstream_in_flight", "Upstream requests in flight")
+
+METRICS = [requests_total, request_seconds, request_upstream_seconds, requests_in_flight, requests_rejected,
+           upstream_total, upstream_seconds, upstream_bytes, upstream_connections, upstream_in_flight]
+
+
+class Timing:
+    # Seconds per phase for one client request. Phases of parallel upstream calls
+    # are summed, so together they can exceed the wall-clock time.
+    PHASES = ("token", "limiter", "connect", "upstream", "serialize", "write")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def get(self, phase: str) -> float:
+        with self._lock:
+            return self.phases.get(phase, 0.0)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    # Server-Timing header value, durations in milliseconds
+    def header(self) -> str:
+        with self._lock:
+            phases = dict(self.phases)
+        parts = [f"{name};dur={phases[name] * 1000:.1f}" for name in self.PHASES if name in phases]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Timing of the client request being handled; copied into worker threads by iter_pages
+current_timing = contextvars.ContextVar("current_timing", default=None)
+
+
+def add_phase(phase: str, seconds: float):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - started)
+
+
+def render() -> bytes:
+    # Token, cache and limiter counters are kept by their modules and read at scrape time
+    from auth import token_stats
+    from response_cache import response_cache
+    from rate_limiter import rate_limiter
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    collected = [
+        ("connector_token_events_total", "Token cache events (refreshes are token fetches)", "event", token_stats()),
+        ("connector_cache_events_total", "Response cache events", "event",
+         {k: v for k, v in response_cache.snapshot().items() if isinstance(v, int) and k not in ("entries", "bytes", "max_bytes")}),
+        ("connector_limiter_events_total", "Upstream rate limiter events", "event",
+         {k: v for k, v in rate_limiter.snapshot().items() if k in ("requests", "throttled", "retries", "waits")}),
+    ]
+    for name, help_text, label, values in collected:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{{label}="{key}"}} {value}' for key, value in sorted(values.items())]
+    cache = response_cache.snapshot()
+    lines += ["# HELP connector_cache_bytes Bytes held by the in-memory response cache",
+              "# TYPE connector_cache_bytes gauge", f"connector_cache_bytes {cache['bytes']}"]
+    return ("\n".join(lines) + "\n").encode("utf-8")
@@ -1,112 +1,94 @@
 import os
-import json
 import polars as pl
-import requests
 from dotenv import load_dotenv
-from auth import get_access_token
-from schema_utils import get_schema
+from schema_utils import get_schema, rows_to_df
+import http_client
+from endpoints import ENDPOINTS
+import sync_store
+import stream_ingest
+from formats import write_table
+from flatten import normalize
+from analytics import reservations_per_property, unit_summary, folio_balances
+from fanout import fan_out
 
 load_dotenv()
-BASE_URL = os.getenv("APALEO_BASE_URL")
-
-# Converts nested structures (dicts/lists) to strings
-def clean_rows(rows: list[dict]) -> list[dict]:
-    return [
-        {
-            key: json.dumps(value) if isinstance(value, (dict, list)) else value
-            for key, value in row.items()
-        }
-        for row in rows
-    ]
-
-# Maps Schema to Polars
-def build_polars_schema(schema: dict) -> dict:
-    def resolve_type(t):
-        if isinstance(t, list):
-            return pl.List(pl.String)
-        elif isinstance(t, dict):
-            return pl.String
-        elif t == "str":
-            return pl.String
-        elif t == "int":
-            return pl.Int64
-        elif t == "float":
-            return pl.Float64
-        elif t == "bool":
-            return pl.Boolean
-        else:
-            return pl.String
-    return {key: resolve_type(t) for key, t in schema.items()}
-
-# Fetches raw Apaleo Data using access token
-def fetch_data(relative_path: str, list_key: str = None) -> list[dict]:
-    token = get_access_token()
-    url = f"{BASE_URL}{relative_path}"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    data = response.json()
+
+# Fetches raw Apaleo Data using access token.
+# With a list_key, all pages are fetched (in parallel) and merged.
+def fetch_data(relative_path: str, list_key: str = None, paginate: bool = True) -> list[dict]:
+    if list_key and paginate:
+        return http_client.fetch_all_pages(relative_path, list_key)[list_key]
+    response = http_client.get(relative_path)
+    data = http_client.read_json(response)
     if list_key:
         return data.get(list_key, [])
     elif isinstance(data, list):
         return data
     return []
 
+# Loads a registered endpoint into a DataFrame.
+# The schema comes from the registry, inferred from the rows fetched here.
+# Entities kept in the local store (see sync_store.py) can be read from there
+# instead, optionally after an incremental sync. With streaming, the response is
+# parsed and converted in chunks of APALEO_STREAM_CHUNK_ROWS rows (see stream_ingest.py).
+def load_df(name: str, from_store: bool = False, sync_first: bool = False, streaming: bool = False) -> pl.DataFrame:
+    if from_store:
+        return sync_store.read_store(name, sync_first=sync_first)
+    if streaming:
+        return stream_ingest.load_streaming(name)
+    endpoint = ENDPOINTS[name]
+    rows = fetch_data(endpoint["path"], list_key=endpoint["list_key"], paginate=endpoint["paged"])
+    schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], rows=rows)[endpoint["list_key"]][0]
+    return rows_to_df(rows, schema)
+
+# Loads several registered endpoints in parallel; returns {name: DataFrame}.
+# Takes about as long as the slowest entity instead of the sum of all of them.
+# With from_store, entities kept in the local store are read from there.
+def load_all(entities: list, from_store: bool = False, sync_first: bool = False) -> dict:
+    def load(name):
+        if name in sync_store.SYNC_ENTITIES:
+            return load_df(name, from_store, sync_first)
+        return load_df(name)
+
+    frames, errors = fan_out(list(entities), load, max_workers=len(entities))
+    if errors:
+        raise Exception("; ".join(f"{name}: {message}" for name, message in errors.items()))
+    return {name: frames[name] for name in entities}
+
 # Example DataFrame loaders
-def load_reservations_df():
-    rows = fetch_data("/booking/v1/reservations", list_key="reservations")
-    schema = get_schema("/booking/v1/reservations", list_key="reservations")["reservations"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+def load_reservations_df(from_store: bool = False, sync_first: bool = False, streaming: bool = False):
+    return load_df("reservations", from_store, sync_first, streaming)
 
 def load_bookings_df():
-    rows = fetch_data("/booking/v1/bookings", list_key="bookings")
-    schema = get_schema("/booking/v1/bookings", list_key="bookings")["bookings"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("bookings")
 
-def load_folios_df():
-    rows = fetch_data("/finance/v1/folios", list_key="folios")
-    schema = get_schema("/finance/v1/folios", list_key="folios")["folios"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+def load_folios_df(from_store: bool = False, sync_first: bool = False, streaming: bool = False):
+    return load_df("folios", from_store, sync_first, streaming)
 
 def load_properties_df():
-    rows = fetch_data("/inventory/v1/properties", list_key="properties")
-    schema = get_schema("/inventory/v1/properties", list_key="properties")["properties"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("properties")
 
 def load_unit_groups_df():
-    rows = fetch_data("/inventory/v1/unit-groups", list_key="unitGroups")
-    schema = get_schema("/inventory/v1/unit-groups", list_key="unitGroups")["unitGroups"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("unit-groups")
 
 def load_units_df():
-    rows = fetch_data("/inventory/v1/units", list_key="units")
-    schema = get_schema("/inventory/v1/units", list_key="units")["units"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("units")
 
 def load_services_df():
-    rows = fetch_data("/rateplan/v1/services", list_key="services")
-    schema = get_schema("/rateplan/v1/services", list_key="services")["services"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("services")
 
 def load_capturepolicies_df():
-    rows = fetch_data("/settings/v1/capture-policies", list_key="capturePolicies")
-    schema = get_schema("/settings/v1/capture-policies", list_key="capturePolicies")["capturePolicies"][0]
-    return pl.from_dicts(clean_rows(rows), schema=build_polars_schema(schema))
+    return load_df("capture-policies")
 
 # Example usage
 if __name__ == "__main__":
 
-    print("\n--- Reservations Table ---")
-    df_reservations = load_reservations_df()
-
-    print("\n--- Unit Groups Table ---")    
-    df_unit_groups = load_unit_groups_df()
-
-    print("\n--- Units Table ---")
-    df_units = load_units_df()
-
-    print("\n--- Folios Table ---")
-    df_folios = load_folios_df()
+    print("\n--- Reservations, Unit Groups, Units and Folios Tables ---")
+    frames = load_all(["reservations", "unit-groups", "units", "folios"])
+    df_reservations = frames["reservations"]
+    df_unit_groups = frames["unit-groups"]
+    df_units = frames["units"]
+    df_folios = frames["folios"]
 
     '''
     print("\n--- Bookings Table ---")
@@ -125,41 +107,19 @@ if __name__ == "__main__":
     df_services = load_services_df()
     print(df_services)
 
-    # Filter all reservations from hotel 'VIE'
-    df_reservations_vie = df_reservations.filter(pl.col("property").str.contains('"id": "VIE"'))
+    # Filter all reservations from hotel 'VIE'; the filter is pushed down as propertyIds=VIE
+    from lazy_scan import scan_reservations
+    df_reservations_vie = scan_reservations().filter(pl.col("property").struct.field("id") == "VIE").collect()
     print("\nReservations in Hotel VIE:")
     print(df_reservations_vie)
 
 
-    # Decode balance JSON string into struct
-    df_folios = df_folios.with_columns([
-        pl.col("balance").str.json_decode().alias("balance_parsed")
-    ])
-
-    # Extract 'amount' and 'currency' as new columns
-    df_folios = df_folios.with_columns([
-        pl.col("balance_parsed").struct.field("amount").alias("amount"),
-        pl.col("balance_parsed").struct.field("currency").alias("currency")
-    ])
+    # Extract 'amount' and 'currency' from the balance struct as new columns
+    df_folios = normalize("folios", df_folios)
 
-    # Define conversion rates
-    conversion_rates = {
-        "EUR": 1.0,
-        "GBP": 1.15,
-        "USD": 0.85
-    }
-
-    # Add conversion rate and converted EUR amount
-    df_folios = df_folios.with_columns([
-        pl.col("currency").map_elements(
-            lambda c: conversion_rates.get(c, 1.0),
-            return_dtype=pl.Float64
-        ).alias("conversion_rate"),
-        (pl.col("amount") * pl.col("currency").map_elements(
-            lambda c: conversion_rates.get(c, 1.0),
-            return_dtype=pl.Float64
-        )).alias("amount_eur")
-    ])
+    # Add conversion rate and converted EUR amount (rates from flatten.CURRENCY_RATES)
+    from flatten import to_eur
+    df_folios = to_eur(df_folios)
 
     # Sort by amount and amount in EUR
     df_sorted = df_folios.sort(["amount", "amount_eur"])
@@ -167,12 +127,7 @@ if __name__ == "__main__":
     print(df_sorted)
 
   '''
-    df_reservations = df_reservations.with_columns([
-        pl.col("property").str.json_decode().alias("property_parsed")
-    ])
-    df_reservations = df_reservations.with_columns([
-        pl.col("property_parsed").struct.field("id").alias("property_id")
-    ])
+    df_reservations = normalize("reservations", df_reservations)
   
     # Group by property_id and count occurrences
     df_counts = df_reservations.group_by("property_id").agg([
@@ -182,12 +137,7 @@ if __name__ == "__main__":
     print(df_counts)
 
     # Unit Groups types per hotel
-    df_unit_groups = df_unit_groups.with_columns([
-        pl.col("property").str.json_decode().alias("property_parsed")
-    ])
-    df_unit_groups = df_unit_groups.with_columns([
-        pl.col("property_parsed").struct.field("id").alias("property_id")
-    ])
+    df_unit_groups = normalize("unit-groups", df_unit_groups)
 
     df_unit_breakdown = df_unit_groups.select([
         pl.col("property_id"),
@@ -203,41 +153,19 @@ if __name__ == "__main__":
 
     # Reservations per Hotel
     print("Reservations per Hotel")
-    df_counts = df_reservations.group_by("property_id").agg([
-        pl.len().alias("reservations")
-    ]).sort("reservations", descending=True)
+    # Same table as /analytics/reservations-per-property on the connector
+    df_counts = reservations_per_property(df_reservations.lazy()).collect()
     print(df_counts)
 
     # Reservations per Hotel Room units
     print("Number of Units and Total Guest Capacity per Property and Room Type")
-    df_units = df_units.with_columns([
-        pl.col("property").map_elements(lambda s: json.loads(s).get("id"), return_dtype=pl.String).alias("property_id"),
-        pl.col("unitGroup").map_elements(lambda s: json.loads(s).get("id"), return_dtype=pl.String).alias("unit_group_id"),
-        pl.col("status").map_elements(lambda s: json.loads(s).get("isOccupied"), return_dtype=pl.Boolean).alias("is_occupied"),
-    ])
-    df_unit_summary = df_units.group_by(["property_id", "unit_group_id"]).agg([
-        pl.len().alias("num_units"),
-        pl.sum("maxPersons").alias("total_capacity"),
-        pl.sum("is_occupied").alias("units_occupied"),
-    ])
+    df_unit_summary = unit_summary(df_units.lazy()).collect()
     print(df_unit_summary)
 
     # Balance per Property and Currency
-    df_folios = df_folios.with_columns([
-        pl.col("balance").str.json_decode().alias("balance_parsed")
-    ]).with_columns([
-        pl.col("balance_parsed").struct.field("amount").alias("amount"),
-        pl.col("balance_parsed").struct.field("currency").alias("currency")
-    ])
-    df_folio_summary = df_folios.select(
-        df_folios
-        .group_by(["id", "currency"])
-        .agg([
-            pl.sum("amount").alias("total_balance")
-        ])
-        .sort("id")
-    )
+    df_folio_summary = folio_balances(df_folios.lazy()).collect()
     print("\nBalances per Property and Currency")
     print(df_folio_summary)
 
-    df_folio_summary.write_csv("folio_summary.csv")
\ No newline at end of file
+    # FOLIO_SUMMARY_PATH=folio_summary.parquet writes Parquet instead of CSV
+    write_table(df_folio_summary, os.getenv("FOLIO_SUMMARY_PATH", "folio_summary.csv"))
\ No newline at end of file
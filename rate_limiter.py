@@ -0,0 +1,125 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+# Sustained upstream requests per second and how many may be sent in a burst
+RATE_LIMIT = float(os.getenv("APALEO_RATE_LIMIT", "10"))
+RATE_BURST = int(os.getenv("APALEO_RATE_BURST", "20"))
+# Upper bound for upstream requests in flight; lowered automatically after 429s
+MAX_CONCURRENCY = int(os.getenv("APALEO_MAX_CONCURRENCY", "16"))
+# Retries of a throttled request and the jittered exponential backoff between them
+MAX_RETRIES = int(os.getenv("APALEO_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("APALEO_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("APALEO_BACKOFF_MAX", "30"))
+
+
+# Seconds from a Retry-After header (delta-seconds or HTTP-date), or None
+def parse_retry_after(value: str):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Full jitter: a random delay between 0 and the exponential backoff for this attempt
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimiter:
+    # Token bucket for the request rate plus an AIMD concurrency limit:
+    # the limit grows by about one per window of successful requests and halves on a 429.
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, max_concurrency=MAX_CONCURRENCY, min_concurrency=1,
+                 decrease_cooldown=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_cooldown = decrease_cooldown
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.stats = {
+            "requests": 0,
+            "throttled": 0,
+            "retries": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "limit_decreases": 0,
+        }
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    # Blocks until a request may be sent
+    def acquire(self):
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    timeout = self._paused_until - now
+                elif self._in_flight >= int(self._limit):
+                    timeout = None
+                elif self._tokens < 1:
+                    timeout = (1 - self._tokens) / self.rate
+                else:
+                    break
+                waited = True
+                self._cond.wait(timeout)
+            self._tokens -= 1
+            self._in_flight += 1
+            self.stats["requests"] += 1
+            if waited:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += time.monotonic() - started
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.stats["throttled"] += 1
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._limit = max(self.min_concurrency, self._limit / 2)
+                    self._last_decrease = now
+                    self.stats["limit_decreases"] += 1
+            else:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    # Holds back every caller, e.g. for the Retry-After of a 429
+    def pause(self, seconds: float):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.stats["retries"] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                "concurrency_limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                "rate": self.rate,
+                "burst": self.burst,
+            }
+
+
+rate_limiter = RateLimiter()
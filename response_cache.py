@@ -0,0 +1,431 @@
+import os
+import json
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, parse_qsl
+import http_client
+import compression
+from singleflight import SingleFlight
+from endpoints import ENDPOINTS, AGE_CATEGORIES
+
+# Total size of all cached bodies; least recently used entries are evicted first
+CACHE_MAX_BYTES = int(os.getenv("APALEO_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Bodies larger than this are streamed through but not cached
+CACHE_MAX_ENTRY_BYTES = int(os.getenv("APALEO_CACHE_MAX_ENTRY_BYTES", str(64 * 1024 * 1024)))
+# TTL for upstream paths that are not in the endpoint registry
+CACHE_DEFAULT_TTL = int(os.getenv("APALEO_CACHE_DEFAULT_TTL", "60"))
+# Serve expired entries right away and revalidate them in the background
+CACHE_STALE_WHILE_REVALIDATE = os.getenv("APALEO_CACHE_STALE_WHILE_REVALIDATE", "true").lower() == "true"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def accepted_encodings(accept_encoding: str) -> list:
+    return [part.split(";")[0].strip().lower() for part in accept_encoding.split(",") if part.strip()]
+
+
+def _decompressor(encoding: str):
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    return None
+
+
+class SerializedItems:
+    # Items of a cached list page serialized once as b"item, item, ..."; len() is the item count
+    __slots__ = ("body", "length")
+
+    def __init__(self, body: bytes, length: int):
+        self.body = body
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+class CacheEntry:
+    # Upstream body as received (possibly still gzip-compressed) plus its validators.
+    # variants holds the body re-encoded for clients, e.g. {"zstd": b"..."}, and
+    # page the items and count of a list page, serialized for list documents.
+    __slots__ = ("body", "encoding", "etag", "last_modified", "expires_at", "variants", "page", "__weakref__")
+
+    def __init__(self, body: bytes, encoding: str, etag: str, last_modified: str, expires_at: float):
+        self.body = body
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.variants = {}
+        self.page = None
+
+    @property
+    def size(self):
+        size = len(self.body) + sum(len(variant) for variant in self.variants.values())
+        return size + (len(self.page[0].body) if self.page else 0)
+
+    def is_fresh(self, now=None):
+        return (time.time() if now is None else now) < self.expires_at
+
+    def decoded(self) -> bytes:
+        decompressor = _decompressor(self.encoding)
+        if decompressor is None:
+            return self.body
+        return decompressor.decompress(self.body) + decompressor.flush()
+
+    def json(self):
+        body = self.decoded()
+        return json.loads(body) if body else {}
+
+
+class ResponseCache:
+    # In-process LRU cache of upstream responses, keyed on path plus query.
+    # Expired entries are revalidated with If-None-Match / If-Modified-Since.
+    # With a disk tier, entries are also written to disk and memory misses are served from it.
+    # The shared instance gets its tier from attach_disk() when the server starts.
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entry_bytes=CACHE_MAX_ENTRY_BYTES,
+                 default_ttl=CACHE_DEFAULT_TTL, stale_while_revalidate=CACHE_STALE_WHILE_REVALIDATE, disk=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.default_ttl = default_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.ttls = {e["path"]: e["ttl"] for e in list(ENDPOINTS.values()) + [AGE_CATEGORIES]}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-revalidate")
+        self.flights = SingleFlight()
+        self.disk = None
+        self._disk_writer = None
+        if disk is not None:
+            self.attach_disk(disk)
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "not_modified": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def key(relative_path: str, params: dict = None) -> str:
+        if not params:
+            return relative_path
+        return f"{relative_path}?{urlencode(sorted(params.items()))}"
+
+    def ttl_for(self, relative_path: str) -> int:
+        return self.ttls.get(relative_path, self.default_ttl)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_entry(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.disk is None:
+            return None
+        row = self.disk.get(key)
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        self._count("disk_hits")
+        self._remember(key, entry)
+        return entry
+
+    # Stores an entry in memory and, if there is a disk tier, on disk
+    def put_entry(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_entry_bytes:
+            return
+        self._remember(key, entry)
+        if self.disk is not None:
+            self._disk_writer.submit(self.disk.put, key, entry.body, entry.encoding, entry.etag,
+                                     entry.last_modified, entry.expires_at)
+
+    def _remember(self, key: str, entry: CacheEntry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.stats["evictions"] += 1
+
+    # True while key still maps to this entry in memory and the entry is fresh
+    def is_current(self, key: str, entry: CacheEntry) -> bool:
+        with self._lock:
+            return self._entries.get(key) is entry and entry.is_fresh()
+
+    # Entry body in the given content encoding. Re-encoded bodies are kept on the
+    # entry (and count toward the cache size) as long as the entry is cached.
+    def encoded(self, key: str, entry: CacheEntry, encoding: str) -> bytes:
+        if encoding == entry.encoding:
+            return entry.body
+        variant = entry.variants.get(encoding)
+        if variant is not None:
+            return variant
+        variant = compression.compress(entry.decoded(), encoding)
+        with self._lock:
+            if self._entries.get(key) is entry and encoding not in entry.variants:
+                entry.variants[encoding] = variant
+                self._bytes += len(variant)
+        return variant
+
+    # The entry as a list page {list_key: SerializedItems, "count": n}. The items are
+    # serialized on first use and kept on the entry (counting toward the cache size)
+    # as long as it is cached, so later list documents are joined from bytes.
+    # on_parse(items) is called when the body had to be parsed.
+    def serialized_page(self, key: str, entry: CacheEntry, list_key: str, on_parse=None) -> dict:
+        page = entry.page
+        if page is None:
+            data = entry.json()
+            items = data.get(list_key) or []
+            if on_parse is not None and items:
+                on_parse(items)
+            body = ", ".join(json.dumps(item) for item in items).encode("utf-8")
+            page = (SerializedItems(body, len(items)), data.get("count", len(items)))
+            with self._lock:
+                if self._entries.get(key) is entry and entry.page is None:
+                    entry.page = page
+                    self._bytes += len(body)
+        return {list_key: page[0], "count": page[1]}
+
+    # Drops entries whose key starts with prefix and, if given, for which match(key) is true.
+    # Returns the number of entries dropped from memory.
+    def invalidate(self, prefix: str = "", match=None) -> int:
+        with self._lock:
+            keys = [k for k in self._entries if k.startswith(prefix) and (match is None or match(k))]
+            for key in keys:
+                self._bytes -= self._entries.pop(key).size
+        if self.disk is not None:
+            # Queued behind pending disk writes, so an older body cannot be written back afterwards
+            self._disk_writer.submit(self.disk.invalidate, prefix, match)
+        return len(keys)
+
+    # Adds the persistent tier below memory. Disk writes happen off the request path,
+    # one at a time and in order.
+    def attach_disk(self, disk):
+        self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-disk")
+        self.disk = disk
+
+    # Loads the most recently used disk entries into memory so a restarted server
+    # answers from them right away; expired ones are revalidated in the background.
+    def warm_start(self) -> int:
+        if self.disk is None:
+            return 0
+        loaded = 0
+        now = time.time()
+        # Oldest first, so the most recently used entries end up last in the LRU order
+        for key, *row in reversed(list(self.disk.recent(self.max_bytes))):
+            entry = CacheEntry(*row)
+            if entry.size > self.max_entry_bytes:
+                continue
+            self._remember(key, entry)
+            loaded += 1
+            if not entry.is_fresh(now):
+                relative_path, _, query = key.partition("?")
+                self._revalidate_in_background(relative_path, dict(parse_qsl(query)) or None, key, entry)
+        return loaded
+
+    def _new_entry(self, relative_path, response, body: bytes) -> CacheEntry:
+        return CacheEntry(
+            body,
+            response.headers.get("Content-Encoding", "identity").lower(),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            time.time() + self.ttl_for(relative_path),
+        )
+
+    def _revalidate(self, relative_path: str, params: dict, key: str, entry: CacheEntry) -> CacheEntry:
+        self._count("revalidations")
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        response = http_client.get(relative_path, params=params, stream=True, headers=headers)
+        with response:
+            if response.status_code == 304:
+                self._count("not_modified")
+                entry.expires_at = time.time() + self.ttl_for(relative_path)
+                if self.disk is not None:
+                    self._disk_writer.submit(self.disk.touch, key, entry.expires_at)
+                return entry
+            fresh = self._new_entry(relative_path, response, response.raw.read(decode_content=False))
+        self.put_entry(key, fresh)
+        return fresh
+
+    def _revalidate_in_background(self, relative_path, params, key, entry):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                self._revalidate(relative_path, params, key, entry)
+            except Exception as e:
+                print(f"[ERROR] Background revalidation of {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        self._background.submit(run)
+
+    def _lookup(self, relative_path, params, key, no_cache):
+        # Returns a usable entry or None on a miss
+        entry = self.get_entry(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        if entry.is_fresh() and not no_cache:
+            self._count("hits")
+            return entry
+        if self.stale_while_revalidate and not no_cache:
+            self._count("stale_hits")
+            self._revalidate_in_background(relative_path, params, key, entry)
+            return entry
+        return self.flights.do(key, lambda: self._revalidate(relative_path, params, key, entry))
+
+    def _fetch_and_store(self, relative_path, params, key) -> CacheEntry:
+        response = http_client.get(relative_path, params=params, stream=True)
+        with response:
+            entry = self._new_entry(relative_path, response, response.raw.read(decode_content=False))
+        self.put_entry(key, entry)
+        return entry
+
+    # Full upstream response through the cache.
+    # Concurrent misses for the same key share one upstream request.
+    def fetch(self, relative_path: str, params: dict = None, no_cache: bool = False) -> CacheEntry:
+        key = self.key(relative_path, params)
+        entry = self._lookup(relative_path, params, key, no_cache)
+        if entry is not None:
+            return entry
+        return self.flights.do(key, lambda: self._fetch_and_store(relative_path, params, key))
+
+    def fetch_json(self, relative_path: str, params: dict = None):
+        return self.fetch(relative_path, params).json()
+
+    # Serves the upstream encoding if the client accepts it, or else the preferred
+    # client encoding, compressed once per entry
+    def _serve_entry(self, key: str, entry: CacheEntry, accept_encoding: str):
+        if entry.encoding != "identity" and entry.encoding in accepted_encodings(accept_encoding):
+            return {"Content-Length": str(len(entry.body)), "Content-Encoding": entry.encoding}, iter([entry.body])
+        body = entry.body if entry.encoding == "identity" else entry.decoded()
+        encoding = compression.negotiate(accept_encoding)
+        if encoding is None or len(body) < compression.COMPRESSION_MIN_BYTES:
+            return {"Content-Length": str(len(body))}, iter([body])
+        body = self.encoded(key, entry, encoding)
+        return {"Content-Length": str(len(body)), "Content-Encoding": encoding}, iter([body])
+
+    # Opens an upstream response as (headers, body chunks) through the cache.
+    # Misses are streamed to the client while the body is collected for the cache.
+    # Concurrent misses for the same key wait for that body instead of fetching it again;
+    # if it turns out too large to cache they fall back to their own request.
+    def open_stream(self, relative_path: str, params: dict = None, accept_encoding: str = "", no_cache: bool = False):
+        key = self.key(relative_path, params)
+        client_encodings = accepted_encodings(accept_encoding)
+        entry = self._lookup(relative_path, params, key, no_cache)
+        if entry is not None:
+            return self._serve_entry(key, entry, accept_encoding)
+
+        flight, leader = self.flights.join(key)
+        if not leader:
+            shared, entry = self.flights.wait(flight)
+            if shared and entry is not None:
+                return self._serve_entry(key, entry, accept_encoding)
+            flight = None
+
+        try:
+            response = http_client.get(relative_path, params=params, stream=True)
+        except Exception as e:
+            if flight is not None:
+                self.flights.finish(key, flight, error=e)
+            raise
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        headers = {}
+        decompressor = None
+        if encoding == "identity" or encoding in client_encodings:
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            if "Content-Length" in response.headers:
+                headers["Content-Length"] = response.headers["Content-Length"]
+        else:
+            decompressor = _decompressor(encoding)
+        state = {}
+
+        def on_close():
+            response.close()
+            if flight is not None:
+                self.flights.finish(key, flight, state.get("entry"))
+
+        return headers, StreamBody(self._tee(relative_path, key, response, decompressor, state), on_close)
+
+    def _tee(self, relative_path, key, response, decompressor, state):
+        collected = []
+        collected_bytes = 0
+        for chunk in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+            if collected is not None:
+                collected.append(chunk)
+                collected_bytes += len(chunk)
+                if collected_bytes > self.max_entry_bytes:
+                    collected = None
+            yield decompressor.decompress(chunk) if decompressor else chunk
+        if decompressor:
+            yield decompressor.flush()
+        if collected is not None:
+            state["entry"] = self._new_entry(relative_path, response, b"".join(collected))
+            self.put_entry(key, state["entry"])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = {**self.stats, "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+        stats["coalescing"] = self.flights.snapshot()
+        stats["compressed_documents"] = compression.compressed_documents.snapshot()
+        if self.disk is not None:
+            stats["disk"] = self.disk.snapshot()
+        return stats
+
+
+class StreamBody:
+    # Iterator over body chunks whose cleanup runs exactly once: when the chunks
+    # are exhausted, iteration fails, or close() is called (even before the first chunk).
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._chunks.close()
+        finally:
+            self._on_close()
+
+
+# Memory only until the server attaches the disk tier, so importing this module does
+# not create the SQLite file
+response_cache = ResponseCache()
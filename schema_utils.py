@@ -1,39 +1,331 @@
+import io
 import os
-import requests
-from auth import get_access_token 
+import json
+import time
+import threading
+import polars as pl
+import http_client
 
-BASE_URL = os.getenv("APALEO_BASE_URL")
+# Seconds an inferred schema is trusted before it is inferred again
+SCHEMA_TTL = int(os.getenv("APALEO_SCHEMA_TTL", "86400"))
+# Number of rows merged into the inferred schema
+SCHEMA_SAMPLE_ROWS = int(os.getenv("APALEO_SCHEMA_SAMPLE_ROWS", "500"))
+# Rows converted to columns at a time by rows_to_df; bounds the memory of the conversion
+DF_CHUNK_ROWS = int(os.getenv("APALEO_DF_CHUNK_ROWS", "2000"))
 
 def infer_schema_from_sample(data):
    # Recursively infer the types of a nested JSON object.
     if isinstance(data, dict):
         return {k: infer_schema_from_sample(v) for k, v in data.items()}
     elif isinstance(data, list) and data:
-        return [infer_schema_from_sample(data[0])]
+        item = None
+        for value in data:
+            item = merge_schema(item, infer_schema_from_sample(value))
+        return [item]
     else:
         return type(data).__name__
 
-def get_schema(relative_path: str, list_key: str = None):
-    token = get_access_token()
-    url = f"{BASE_URL}{relative_path}"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    data = response.json()
+# Combines two inferred schemas, e.g. a field that is null in one row and a str in another
+def merge_schema(a, b):
+    if a is None or a == "NoneType":
+        return b
+    if b is None or b == "NoneType":
+        return a
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = merge_schema(a.get(key), value)
+        return merged
+    if isinstance(a, list) or isinstance(b, list):
+        # An empty list is inferred as the plain type name "list"
+        if not isinstance(a, list):
+            return b
+        if not isinstance(b, list):
+            return a
+        return [merge_schema(a[0], b[0])]
+    if a in ("int", "float") and b in ("int", "float"):
+        return "float" if "float" in (a, b) else "int"
+    return a
 
-    schema = {}
+_SCALAR_TYPES = {str: "str", int: "int", float: "float", bool: "bool"}
 
-    # Add top-level metadata like 'count'
-    if isinstance(data, dict):
-        for key, value in data.items():
-            # If it's the list_key, we handle it differently
-            if key == list_key and isinstance(value, list) and value:
-                schema[key] = [infer_schema_from_sample(value[0])]
-            elif key != list_key:
-                schema[key] = type(value).__name__
-
-    # If response is a direct list (not wrapped)
-    elif isinstance(data, list) and data:
-        schema = infer_schema_from_sample(data[0])
+# True if merging the value into the schema would not change it: every key, nested
+# ones included, is known and no value was only ever seen as null
+def is_known(value, t) -> bool:
+    if isinstance(value, dict):
+        if not isinstance(t, dict):
+            return False
+        for key, item in value.items():
+            if key not in t:
+                return False
+            if item is None:
+                continue
+            sub = t[key]
+            name = _SCALAR_TYPES.get(type(item))
+            if name is not None:
+                if sub != name and not (sub == "float" and name == "int"):
+                    return False
+            elif not is_known(item, sub):
+                return False
+        return True
+    if isinstance(value, list):
+        if not value:
+            return True
+        if not isinstance(t, list):
+            return False
+        return all(is_known(item, t[0]) for item in value)
+    if value is None:
+        return True
+    name = _SCALAR_TYPES.get(type(value))
+    return name == t or (t == "float" and name == "int")
 
+# Infers the schema from the first sample_size rows; the remaining rows are only
+# checked for fields the sample did not show, which are merged in
+def infer_schema_from_rows(rows: list, sample_size: int = SCHEMA_SAMPLE_ROWS) -> dict:
+    schema = {}
+    for row in rows[:sample_size]:
+        schema = merge_schema(schema, infer_schema_from_sample(row))
+    for row in rows[sample_size:]:
+        if not is_known(row, schema):
+            schema = merge_schema(schema, infer_schema_from_sample(row))
     return schema
+
+
+# Maps Schema to Polars. Nested objects become Structs and arrays become Lists,
+# so nested fields are usable directly with .struct.field() / .list.*.
+def build_polars_schema(schema: dict) -> dict:
+    def resolve_type(t):
+        if isinstance(t, list):
+            return pl.List(resolve_type(t[0]))
+        elif isinstance(t, dict):
+            # An object that was only ever seen empty has no fields to build a Struct from
+            if not t:
+                return pl.String
+            return pl.Struct({key: resolve_type(value) for key, value in t.items()})
+        elif t == "list":
+            return pl.List(pl.String)
+        elif t == "str":
+            return pl.String
+        elif t == "int":
+            return pl.Int64
+        elif t == "float":
+            return pl.Float64
+        elif t == "bool":
+            return pl.Boolean
+        else:
+            return pl.String
+    return {key: resolve_type(t) for key, t in schema.items()}
+
+# True if a JSON value is stored unchanged in a column built from the inferred type:
+# no bool read as an int, no float truncated, no string nulled, no object key dropped
+def value_fits(value, t) -> bool:
+    return _fits(t)(value)
+
+# Compiles the value_fits check for one type, so a column is checked without
+# dispatching on the type for every value
+def _fits(t):
+    if isinstance(t, list):
+        item = _fits(t[0])
+        return lambda value: value is None or (type(value) is list and all(item(x) for x in value))
+    if isinstance(t, dict) and t:
+        fields = {key: _fits(sub) for key, sub in t.items()}
+        def fits_object(value):
+            if value is None:
+                return True
+            if type(value) is not dict:
+                return False
+            for key, item in value.items():
+                field = fields.get(key)
+                if field is None or not field(item):
+                    return False
+            return True
+        return fits_object
+    if t == "list":
+        return lambda value: value is None or (type(value) is list and all(x is None or type(x) is str for x in value))
+    if t == "float":
+        return lambda value: value is None or type(value) is float or type(value) is int
+    # str, NoneType and objects only ever seen empty are String columns
+    kind = {"int": int, "bool": bool}.get(t, str)
+    return lambda value: value is None or type(value) is kind
+
+# Compiles a function turning ints into floats where the type says float inside a
+# list, or returns None if the type has no such field: strict from_dicts rejects a list
+# mixing both. Values that need no change are returned as is.
+def _widen_ints(t, in_list=False):
+    if isinstance(t, list):
+        item = _widen_ints(t[0], True)
+        if item is None:
+            return None
+        def widen_list(value):
+            if value is None:
+                return None
+            widened = [item(x) for x in value]
+            return value if all(new is old for new, old in zip(widened, value)) else widened
+        return widen_list
+    if isinstance(t, dict):
+        fields = {key: _widen_ints(sub, in_list) for key, sub in t.items()}
+        fields = {key: widen for key, widen in fields.items() if widen is not None}
+        if not fields:
+            return None
+        def widen_object(value):
+            if value is None:
+                return None
+            widened = None
+            for key, widen in fields.items():
+                item = value.get(key)
+                if item is None:
+                    continue
+                new = widen(item)
+                if new is not item:
+                    if widened is None:
+                        widened = dict(value)
+                    widened[key] = new
+            return value if widened is None else widened
+        return widen_object
+    if t == "float" and in_list:
+        return lambda value: float(value) if type(value) is int else value
+    return None
+
+# Builds a DataFrame with native Struct/List columns from raw rows.
+# Every value is checked against the inferred type first. Columns holding values that
+# do not fit (e.g. a field first seen as null that later holds an object, or an int
+# field that receives a string or a float) are stored as JSON strings instead, as are
+# keys the schema does not know, so from_dicts never has to coerce anything.
+def rows_to_df(rows: list[dict], schema: dict) -> pl.DataFrame:
+    drifted = set()
+    for key, t in schema.items():
+        if not all(map(_fits(t), [row.get(key) for row in rows])):
+            drifted.add(key)
+    extra = {}
+    for row in rows:
+        for key in row:
+            if key not in schema:
+                extra[key] = "str"
+    text = drifted | extra.keys()
+    schema = {**{key: ("str" if key in drifted else t) for key, t in schema.items()}, **extra}
+    wideners = {key: _widen_ints(t) for key, t in schema.items() if isinstance(t, (dict, list))}
+    wideners = {key: widen for key, widen in wideners.items() if widen is not None}
+    if text or wideners:
+        rows = [_conform(row, text, wideners) for row in rows]
+    return _build(rows, build_polars_schema(schema))
+
+def _conform(row: dict, text: set, wideners: dict) -> dict:
+    changed = None
+    for key in text:
+        value = row.get(key)
+        if value is not None and not isinstance(value, str):
+            if changed is None:
+                changed = dict(row)
+            changed[key] = json.dumps(value)
+    for key, widen in wideners.items():
+        value = row.get(key)
+        if value is None:
+            continue
+        new = widen(value)
+        if new is not value:
+            if changed is None:
+                changed = dict(row)
+            changed[key] = new
+    return row if changed is None else changed
+
+# Builds the frame DF_CHUNK_ROWS rows at a time. from_dicts keeps the spare capacity of
+# its builders, often many times the data for nested rows, so every chunk is compacted
+# before the next one is built.
+def _build(rows: list[dict], polars_schema: dict) -> pl.DataFrame:
+    if len(rows) <= DF_CHUNK_ROWS:
+        return compact(pl.from_dicts(rows, schema=polars_schema, strict=True))
+    frames = [compact(pl.from_dicts(rows[start:start + DF_CHUNK_ROWS], schema=polars_schema, strict=True))
+              for start in range(0, len(rows), DF_CHUNK_ROWS)]
+    return pl.concat(frames)
+
+# Copies a frame into tightly sized Arrow buffers
+def compact(frame: pl.DataFrame) -> pl.DataFrame:
+    buffer = io.BytesIO()
+    frame.write_ipc(buffer)
+    return pl.read_ipc(buffer.getvalue())
+
+
+class SchemaRegistry:
+    # Item schema per endpoint, inferred from rows that were fetched anyway.
+    # A schema is only re-inferred when it expires or a row brings a new field,
+    # at the top level or nested;
+    # every change bumps its version.
+    def __init__(self, ttl=SCHEMA_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(relative_path: str) -> str:
+        return relative_path.split("?")[0]
+
+    def get(self, relative_path: str):
+        entry = self._entries.get(self.key(relative_path))
+        if entry is None or time.time() >= entry["inferred_at"] + self.ttl:
+            return None
+        return entry
+
+    def version(self, relative_path: str) -> int:
+        entry = self._entries.get(self.key(relative_path))
+        return entry["version"] if entry else 0
+
+    def observe(self, relative_path: str, rows: list, meta: dict = None) -> dict:
+        key = self.key(relative_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            expired = entry is None or time.time() >= entry["inferred_at"] + self.ttl
+            if not expired:
+                new_rows = [row for row in rows if not is_known(row, entry["schema"])]
+                if not new_rows and meta is None:
+                    return entry
+                schema = merge_schema(entry["schema"], infer_schema_from_rows(new_rows))
+            else:
+                schema = infer_schema_from_rows(rows)
+            version = entry["version"] if entry else 0
+            if entry is None or schema != entry["schema"]:
+                version += 1
+            entry = {
+                "schema": schema,
+                "meta": meta if meta is not None else (entry["meta"] if entry else {"count": "int"}),
+                "version": version,
+                "inferred_at": time.time(),
+            }
+            self._entries[key] = entry
+            return entry
+
+    def invalidate(self, relative_path: str):
+        with self._lock:
+            self._entries.pop(self.key(relative_path), None)
+
+    # Same shape as the upstream response: {list_key: [item schema], "count": "int", ...}
+    def describe(self, relative_path: str, list_key: str = None) -> dict:
+        entry = self._entries[self.key(relative_path)]
+        if not list_key:
+            return entry["schema"]
+        return {list_key: [entry["schema"]], **entry["meta"]}
+
+
+schema_registry = SchemaRegistry()
+
+
+# Returns the schema of an endpoint from the registry.
+# Pass rows that were already fetched to keep it current; the endpoint is only
+# fetched (with the given params, e.g. a small first page) when nothing is registered.
+def get_schema(relative_path: str, list_key: str = None, rows: list = None, params: dict = None, fetch_json=None):
+    if rows is not None:
+        schema_registry.observe(relative_path, rows)
+    elif schema_registry.get(relative_path) is None:
+        if fetch_json is None:
+            data = http_client.read_json(http_client.get(relative_path, params=params))
+        else:
+            data = fetch_json(relative_path, params)
+
+        # Add top-level metadata like 'count'
+        if isinstance(data, dict):
+            meta = {key: type(value).__name__ for key, value in data.items() if key != list_key}
+            schema_registry.observe(relative_path, data.get(list_key) or [], meta)
+        # If response is a direct list (not wrapped)
+        else:
+            schema_registry.observe(relative_path, data or [])
+
+    return schema_registry.describe(relative_path, list_key)
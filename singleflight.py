@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+
+# Seconds a finished result is still handed to new callers of the same key
+COALESCE_WINDOW = float(os.getenv("APALEO_COALESCE_WINDOW", "0"))
+# Seconds a caller waits for someone else's in-flight request before fetching on its own
+COALESCE_WAIT_TIMEOUT = float(os.getenv("APALEO_COALESCE_WAIT_TIMEOUT", "30"))
+# Whether waiters get the leader's error (true) or retry on their own (false)
+COALESCE_SHARE_ERRORS = os.getenv("APALEO_COALESCE_SHARE_ERRORS", "true").lower() == "true"
+
+
+class Flight:
+    __slots__ = ("event", "result", "error", "done_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.done_at = None
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key into one: the first caller (leader)
+    # does the work, everyone else waits for and shares its result.
+    def __init__(self, window=COALESCE_WINDOW, wait_timeout=COALESCE_WAIT_TIMEOUT, share_errors=COALESCE_SHARE_ERRORS):
+        self.window = window
+        self.wait_timeout = wait_timeout
+        self.share_errors = share_errors
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "collapsed": 0, "fallbacks": 0}
+
+    def _expired(self, flight, now):
+        return flight.done_at is not None and (flight.error is not None or now - flight.done_at > self.window)
+
+    # Returns (flight, is_leader). A leader must call finish() exactly once.
+    def join(self, key):
+        now = time.monotonic()
+        with self._lock:
+            for stale_key in [k for k, f in self._flights.items() if self._expired(f, now)]:
+                del self._flights[stale_key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats["collapsed"] += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        flight.result = result
+        flight.error = error
+        flight.done_at = time.monotonic()
+        with self._lock:
+            if self.window <= 0 or error is not None:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        flight.event.set()
+
+    # Waits for a leader. Returns (True, result), or (False, None) if the caller should fetch on its own.
+    def wait(self, flight):
+        if not flight.event.wait(self.wait_timeout):
+            self._count_fallback()
+            return False, None
+        if flight.error is not None:
+            if self.share_errors:
+                raise flight.error
+            self._count_fallback()
+            return False, None
+        return True, flight.result
+
+    def _count_fallback(self):
+        with self._lock:
+            self.stats["fallbacks"] += 1
+
+    def do(self, key, fn):
+        flight, leader = self.join(key)
+        if leader:
+            try:
+                result = fn()
+            except Exception as e:
+                self.finish(key, flight, error=e)
+                raise
+            self.finish(key, flight, result)
+            return result
+        shared, result = self.wait(flight)
+        if shared:
+            return result
+        return fn()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "in_flight": sum(1 for f in self._flights.values() if f.done_at is None)}
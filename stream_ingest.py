@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import codecs
+import polars as pl
+import http_client
+from endpoints import ENDPOINTS
+from schema_utils import schema_registry, rows_to_df
+
+# Rows per DataFrame chunk; peak memory grows with this instead of with the dataset
+STREAM_CHUNK_ROWS = int(os.getenv("APALEO_STREAM_CHUNK_ROWS", "2000"))
+# Bytes read from the upstream response at a time
+STREAM_READ_BYTES = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JSONStream:
+    # Text buffer over a stream of byte chunks that json values are decoded from one by one.
+    # Consumed text is dropped, so only the value being decoded is held in memory.
+    def __init__(self, byte_chunks):
+        self._chunks = iter(byte_chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def _read(self) -> bool:
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                if self.pos > len(self.buffer) // 2:
+                    self.buffer = self.buffer[self.pos:]
+                    self.pos = 0
+                self.buffer += text
+                return True
+        self.exhausted = True
+        return False
+
+    # Next non-whitespace character, without consuming it ("" at the end)
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        char = self.peek()
+        if not char or char not in characters:
+            raise ValueError(f"Expected one of {characters!r} at offset {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        while True:
+            self.peek()
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or self.exhausted or not self._read():
+                self.pos = end
+                return value
+
+
+# Yields the items of a JSON document like {"<list_key>": [...], "count": n} one by one
+# while reading it, or of a top-level array. Other top-level fields go into meta.
+def iter_json_items(byte_chunks, list_key: str = None, meta: dict = None):
+    stream = _JSONStream(byte_chunks)
+    if stream.expect("{[") == "[":
+        yield from _iter_array(stream)
+        return
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == list_key and stream.peek() == "[":
+            stream.expect("[")
+            yield from _iter_array(stream)
+        else:
+            value = stream.value()
+            if meta is not None:
+                meta[key] = value
+        if stream.expect(",}") == "}":
+            return
+
+
+def _iter_array(stream: _JSONStream):
+    if stream.peek() == "]":
+        stream.expect("]")
+        return
+    while True:
+        yield stream.value()
+        if stream.expect(",]") == "]":
+            return
+
+
+# Reads a streamed page response. The items are parsed while they are consumed, so only
+# the item being parsed is held; the other top-level fields are set once they are read.
+def read_page(response, list_key: str) -> dict:
+    page = {}
+    page[list_key] = _read_items(response, list_key, page)
+    return page
+
+
+def _read_items(response, list_key: str, meta: dict):
+    with response:
+        if response.status_code == 204:
+            return
+        yield from iter_json_items(response.iter_content(STREAM_READ_BYTES), list_key, meta)
+
+
+# Yields the items of a list endpoint page by page, while each page is downloaded.
+# Once the first page told the count, the next page is already requested while the
+# current one is parsed; only its headers are read until it is needed.
+def iter_items(relative_path: str, list_key: str, params: dict = None, paginate: bool = True,
+               page_size: int = http_client.PAGE_SIZE):
+    if paginate:
+        pages = http_client.iter_pages(relative_path, list_key, params, page_size=page_size, max_workers=1,
+                                       stream=True, read_page=lambda response: read_page(response, list_key))
+    else:
+        pages = [read_page(http_client.get(relative_path, params=params, stream=True), list_key)]
+    for page in pages:
+        yield from page.get(list_key, [])
+
+
+# Yields DataFrames of at most chunk_rows rows. Every chunk is built with the registered
+# schema of the endpoint, which is kept current from the rows as they arrive.
+def iter_frames(relative_path: str, list_key: str, params: dict = None, paginate: bool = True,
+                chunk_rows: int = STREAM_CHUNK_ROWS):
+    rows = []
+    for item in iter_items(relative_path, list_key, params, paginate):
+        rows.append(item)
+        if len(rows) >= chunk_rows:
+            yield _frame(relative_path, rows)
+            rows = []
+    if rows:
+        yield _frame(relative_path, rows)
+
+
+def _frame(relative_path: str, rows: list) -> pl.DataFrame:
+    schema = schema_registry.observe(relative_path, rows)["schema"]
+    return rows_to_df(rows, schema)
+
+
+# Loads a registered endpoint chunk by chunk. Only the columnar result and one chunk
+# of parsed rows are held at a time, instead of every row as a Python dict.
+def load_streaming(name: str, params: dict = None, chunk_rows: int = STREAM_CHUNK_ROWS) -> pl.DataFrame:
+    endpoint = ENDPOINTS[name]
+    frames = list(iter_frames(endpoint["path"], endpoint["list_key"], params, endpoint["paged"], chunk_rows))
+    if not frames:
+        return pl.DataFrame()
+    # Chunks that saw new fields have more columns; the others are filled with nulls
+    return pl.concat(frames, how="diagonal_relaxed")
+
+
+# Writes a registered endpoint to <directory>/part-<n>.parquet, one file per chunk,
+# so memory stays bounded by the chunk size. Returns the written paths.
+def sink_parquet(name: str, directory: str, params: dict = None, chunk_rows: int = STREAM_CHUNK_ROWS) -> list:
+    endpoint = ENDPOINTS[name]
+    os.makedirs(directory, exist_ok=True)
+    for old in scan_paths(directory):
+        os.remove(old)
+    paths = []
+    for number, frame in enumerate(iter_frames(endpoint["path"], endpoint["list_key"], params,
+                                               endpoint["paged"], chunk_rows)):
+        path = os.path.join(directory, f"part-{number:05d}.parquet")
+        frame.write_parquet(path)
+        paths.append(path)
+    return paths
+
+
+def scan_paths(directory: str) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith("part-") and name.endswith(".parquet"))
+
+
+# Lazily scans the parts written by sink_parquet
+def scan_sink(directory: str) -> pl.LazyFrame:
+    paths = scan_paths(directory)
+    if not paths:
+        raise FileNotFoundError(f"No parts in '{directory}'. Run sink_parquet() first.")
+    return pl.concat([pl.scan_parquet(path) for path in paths], how="diagonal_relaxed")
@@ -0,0 +1,226 @@
+import os
+import json
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+import polars as pl
+from endpoints import ENDPOINTS
+from schema_utils import get_schema, rows_to_df
+from stream_ingest import iter_items
+
+# Local columnar store: <STORE_DIR>/<entity>/property=<id>/month=<YYYY-MM>/data.parquet
+STORE_DIR = os.getenv("APALEO_STORE_DIR", "data")
+# Records modified this many seconds before the last watermark are fetched again,
+# to cover clock skew and records committed while the previous sync ran
+SYNC_OVERLAP = int(os.getenv("APALEO_SYNC_OVERLAP", "300"))
+# Records parsed and upserted at a time, which bounds the memory of a full sync
+SYNC_CHUNK_ROWS = int(os.getenv("APALEO_SYNC_CHUNK_ROWS", "10000"))
+
+# Entities kept in the store: which endpoint they come from, the upstream
+# "modified since" filter, and the date field used for the month partition
+SYNC_ENTITIES = {
+    "reservations": {
+        "endpoint": "reservations",
+        "modified_params": {"dateFilter": "Modification"},
+        "modified_from": "from",
+        "date_field": "arrival",
+    },
+    "folios": {
+        "endpoint": "folios",
+        "modified_params": {},
+        "modified_from": "updatedFrom",
+        "date_field": "created",
+    },
+}
+
+_sync_lock = threading.Lock()
+
+
+def _entity_dir(entity: str) -> str:
+    return os.path.join(STORE_DIR, entity)
+
+
+def _state_path() -> str:
+    return os.path.join(STORE_DIR, "_state.json")
+
+
+def load_state() -> dict:
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state: dict):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = f"{_state_path()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, _state_path())
+
+
+def _partition_of(row: dict, date_field: str) -> tuple:
+    prop = row.get("property")
+    property_id = prop.get("id") if isinstance(prop, dict) else None
+    date = row.get(date_field) or ""
+    return property_id or "unknown", date[:7] or "unknown"
+
+
+def _partition_path(entity: str, partition: tuple) -> str:
+    property_id, month = partition
+    return os.path.join(_entity_dir(entity), f"property={property_id}", f"month={month}", "data.parquet")
+
+
+def partition_files(entity: str) -> list:
+    files = []
+    for root, _, names in os.walk(_entity_dir(entity)):
+        files.extend(os.path.join(root, name) for name in names if name == "data.parquet")
+    return sorted(files)
+
+
+def _write_partition(path: str, df: pl.DataFrame):
+    if df.is_empty():
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# Inserts or replaces rows by id. A record that moved to another partition
+# (e.g. a changed arrival date) is removed from its old one.
+def upsert(entity: str, rows: list, schema: dict) -> int:
+    if not rows:
+        return 0
+    date_field = SYNC_ENTITIES[entity]["date_field"]
+    changed_ids = list({row["id"] for row in rows})
+    groups = {}
+    for row in rows:
+        groups.setdefault(_partition_path(entity, _partition_of(row, date_field)), []).append(row)
+
+    affected = set(groups)
+    for path in partition_files(entity):
+        ids = pl.read_parquet(path, columns=["id"])["id"]
+        if ids.is_in(changed_ids).any():
+            affected.add(path)
+
+    for path in affected:
+        frames = []
+        if os.path.exists(path):
+            frames.append(pl.read_parquet(path).filter(~pl.col("id").is_in(changed_ids)))
+        if path in groups:
+            frames.append(rows_to_df(groups[path], schema))
+        _write_partition(path, pl.concat(frames, how="diagonal_relaxed"))
+    return len(changed_ids)
+
+
+# Removes records by id from every partition that holds them
+def delete(entity: str, ids: list) -> int:
+    removed = 0
+    for path in partition_files(entity):
+        df = pl.read_parquet(path)
+        kept = df.filter(~pl.col("id").is_in(ids))
+        if kept.height != df.height:
+            removed += df.height - kept.height
+            _write_partition(path, kept)
+    return removed
+
+
+# Applies known changes (e.g. from webhooks) to an entity that has been synced before.
+# Returns False if there is no local data for the entity yet.
+def apply_changes(entity: str, rows: list, deleted_ids: list = ()) -> bool:
+    endpoint = ENDPOINTS[SYNC_ENTITIES[entity]["endpoint"]]
+    with _sync_lock:
+        if entity not in load_state():
+            return False
+        if deleted_ids:
+            delete(entity, list(deleted_ids))
+        if rows:
+            schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], rows=rows)[endpoint["list_key"]][0]
+            upsert(entity, rows, schema)
+    return True
+
+
+def _drop_unseen(entity: str, seen_ids: set):
+    seen = list(seen_ids)
+    for path in partition_files(entity):
+        df = pl.read_parquet(path)
+        kept = df.filter(pl.col("id").is_in(seen))
+        if kept.height != df.height:
+            _write_partition(path, kept)
+
+
+def _upsert_chunk(entity: str, endpoint: dict, rows: list) -> int:
+    if not rows:
+        return 0
+    schema = get_schema(endpoint["path"], list_key=endpoint["list_key"], rows=rows)[endpoint["list_key"]][0]
+    return upsert(entity, rows, schema)
+
+
+# Fetches records modified since the entity's watermark and upserts them.
+# The first run (or full=True) pulls everything.
+def sync(entity: str, full: bool = False) -> dict:
+    config = SYNC_ENTITIES[entity]
+    endpoint = ENDPOINTS[config["endpoint"]]
+    with _sync_lock:
+        state = load_state()
+        entity_state = state.get(entity, {})
+        started = datetime.now(timezone.utc)
+        params = {}
+        watermark = entity_state.get("watermark")
+        if watermark and not full:
+            since = datetime.fromisoformat(watermark) - timedelta(seconds=SYNC_OVERLAP)
+            params = {**config["modified_params"], config["modified_from"]: since.isoformat(timespec="seconds")}
+
+        # Streamed and upserted in chunks, so a large first sync never holds every record at once
+        upserted = 0
+        seen_ids = set()
+        rows = []
+        for item in iter_items(endpoint["path"], endpoint["list_key"], params=params):
+            rows.append(item)
+            seen_ids.add(item.get("id"))
+            if len(rows) >= SYNC_CHUNK_ROWS:
+                upserted += _upsert_chunk(entity, endpoint, rows)
+                rows = []
+        upserted += _upsert_chunk(entity, endpoint, rows)
+        if full:
+            # Records that no longer exist upstream; the old data stays until the pull has succeeded
+            _drop_unseen(entity, seen_ids)
+
+        entity_state = {
+            "watermark": started.isoformat(timespec="seconds"),
+            "last_sync": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "last_upserted": upserted,
+            "incremental": bool(params),
+        }
+        state[entity] = entity_state
+        _save_state(state)
+        return entity_state
+
+
+# Lazily scans an entity from the local store; partitions written with
+# slightly different schemas are aligned column by column.
+def scan_store(entity: str) -> pl.LazyFrame:
+    files = partition_files(entity)
+    if not files:
+        raise FileNotFoundError(f"No local data for '{entity}'. Run sync('{entity}') first.")
+    return pl.concat([pl.scan_parquet(path) for path in files], how="diagonal_relaxed")
+
+
+def read_store(entity: str, sync_first: bool = False) -> pl.DataFrame:
+    if sync_first:
+        sync(entity)
+    return scan_store(entity).collect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync Apaleo entities into the local Parquet store")
+    parser.add_argument("entities", nargs="*", default=list(SYNC_ENTITIES), choices=list(SYNC_ENTITIES))
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and pull everything")
+    args = parser.parse_args()
+    for name in args.entities:
+        result = sync(name, full=args.full)
+        print(f"[INFO] {name}: {result['last_upserted']} records upserted, watermark {result['watermark']}")
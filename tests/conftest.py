@@ -0,0 +1,30 @@
+import os
+import sys
+import threading
+import pytest
+
+# The modules read their configuration at import time: keep the tests offline
+# and away from the token file.
+os.environ.setdefault("APALEO_BASE_URL", "http://127.0.0.1:9/")
+os.environ.setdefault("APALEO_TOKEN_URL", "http://127.0.0.1:9/connect/token")
+os.environ.pop("APALEO_TOKEN_CACHE_FILE", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Starts connector servers on free ports: connector(handler_class, **server_options) -> port
+@pytest.fixture
+def connector():
+    from apaleo_connector import BoundedThreadingHTTPServer
+    servers = []
+
+    def start(handler_class, **kwargs):
+        server = BoundedThreadingHTTPServer(("127.0.0.1", 0), handler_class, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
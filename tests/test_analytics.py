@@ -0,0 +1,20 @@
+import json
+import http.client
+import polars as pl
+import analytics
+from apaleo_connector import ApaleoHandler
+from analytics import MaterializedTable
+
+
+def test_first_request_carries_the_refresh_time(connector, monkeypatch):
+    table = MaterializedTable("test", [], lambda: pl.LazyFrame({"n": [1, 2]}))
+    monkeypatch.setitem(analytics.tables, "test", table)
+    port = connector(ApaleoHandler)
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", "/analytics/test")
+    response = connection.getresponse()
+    body = json.loads(response.read())
+    connection.close()
+    assert response.status == 200
+    assert response.getheader("X-Refreshed-At") == body["refreshedAt"] == table.refreshed_at
+    assert body["rows"] == [{"n": 1}, {"n": 2}]
@@ -0,0 +1,99 @@
+import io
+import json
+import pytest
+import requests
+import auth
+import http_client
+from auth import TokenManager
+from http_client import path_label
+from rate_limiter import RateLimiter
+
+
+def response(status: int, body=None, headers: dict = None) -> requests.Response:
+    content = json.dumps(body).encode("utf-8") if body is not None else b""
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    result._content = content
+    result.raw = io.BytesIO(content)
+    return result
+
+
+class FakeSession:
+    # Answers requests from a list of prepared responses and records what was sent
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False):
+        self.sent.append({"url": url, "headers": dict(headers or {}), "timeout": timeout})
+        return self.responses.pop(0)
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.sent.append({"url": url, "data": data, "timeout": timeout})
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    session = FakeSession([])
+    limiter = RateLimiter(rate=1000, burst=1000)
+    monkeypatch.setattr(http_client, "get_session", lambda: session)
+    monkeypatch.setattr(http_client, "rate_limiter", limiter)
+    tokens = iter(["token-1", "token-2", "token-3"])
+    monkeypatch.setattr(auth, "request_token", lambda: {"access_token": next(tokens), "expires_in": 3600})
+    monkeypatch.setattr(auth, "token_manager", TokenManager(cache_file=None))
+    session.limiter = limiter
+    return session
+
+
+def test_429_is_retried_after_retry_after(upstream):
+    upstream.responses += [response(429, headers={"Retry-After": "0"}), response(429), response(200, {"ok": True})]
+    result = http_client.get("/booking/v1/reservations")
+    assert result.json() == {"ok": True}
+    assert len(upstream.sent) == 3
+    stats = upstream.limiter.snapshot()
+    assert (stats["throttled"], stats["retries"], stats["in_flight"]) == (2, 2, 0)
+
+
+def test_429_gives_up_after_max_retries(upstream, monkeypatch):
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 1)
+    upstream.responses += [response(429, headers={"Retry-After": "0"}) for _ in range(2)]
+    with pytest.raises(requests.HTTPError):
+        http_client.get("/booking/v1/reservations")
+    assert len(upstream.sent) == 2
+
+
+def test_401_refreshes_the_token_and_retries_once(upstream):
+    upstream.responses += [response(401), response(200, {"ok": True})]
+    assert http_client.get("/booking/v1/reservations").json() == {"ok": True}
+    assert [sent["headers"]["Authorization"] for sent in upstream.sent] == ["Bearer token-1", "Bearer token-2"]
+    upstream.responses += [response(401), response(401)]
+    with pytest.raises(requests.HTTPError):
+        http_client.get("/booking/v1/reservations")
+    assert len(upstream.sent) == 4
+
+
+def test_token_request_uses_the_shared_session_with_a_timeout(monkeypatch):
+    session = FakeSession([response(200, {"access_token": "t", "expires_in": 60})])
+    monkeypatch.setattr(http_client, "get_session", lambda: session)
+    assert auth.request_token()["access_token"] == "t"
+    assert session.sent[0]["url"] == auth.TOKEN_URL
+    assert session.sent[0]["timeout"] == (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
+
+
+def test_background_refresh_from_the_cache_file_is_not_counted(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, "request_token", lambda: pytest.fail("token requested"))
+    cache_file = tmp_path / "token.json"
+    cache_file.write_text(json.dumps({"access_token": "shared", "expires_at": 4102444800}))
+    manager = TokenManager(cache_file=str(cache_file))
+    manager._background_refresh()
+    assert manager._token == "shared"
+    assert (manager.stats["file_loads"], manager.stats["background_refreshes"]) == (1, 0)
+
+
+def test_path_label_uses_route_templates():
+    assert path_label("/booking/v1/reservations") == "/booking/v1/reservations"
+    assert path_label("/booking/v1/reservations/RES00000001-1") == "/booking/v1/reservations/{id}"
+    assert path_label("finance/v1/folios/F-1?expand=charges") == "/finance/v1/folios/{id}"
+    assert path_label("/booking/v1/reservations/R-1/actions/cancel") == "other"
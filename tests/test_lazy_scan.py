@@ -0,0 +1,100 @@
+import polars as pl
+import pytest
+import http_client
+import lazy_scan
+from lazy_scan import extract_filters, pushdown_params
+
+# The predicate is read from Expr.meta.serialize(format="json"), whose layout is
+# specific to the Polars version pinned in requirements.txt
+assert pl.__version__ == "1.31.0"
+
+
+def test_extract_filters_reads_and_ed_comparisons():
+    predicate = ((pl.col("property").struct.field("id") == "VIE")
+                 & (pl.col("arrival") >= "2024-06-01")
+                 & (pl.col("arrival") < "2024-07-01")
+                 & pl.col("status").is_in(["Confirmed", "InHouse"]))
+    assert extract_filters(predicate) == {
+        "property.id": ("in", {"VIE"}),
+        "arrival": ("range", ("2024-06-01", "2024-07-01")),
+        "status": ("in", {"Confirmed", "InHouse"}),
+    }
+
+
+def test_extract_filters_flips_literal_on_the_left():
+    assert extract_filters(pl.lit("2024-06-01") <= pl.col("departure")) == {"departure": ("range", ("2024-06-01", None))}
+
+
+def test_extract_filters_ignores_or_and_non_string_literals():
+    assert extract_filters((pl.col("status") == "Confirmed") | (pl.col("status") == "InHouse")) == {}
+    assert extract_filters(pl.col("adults") > 2) == {}
+
+
+def test_pushdown_params_widen_date_ranges():
+    filters = {"arrival": ("range", ("2024-06-01", "2024-07-01")), "property.id": ("in", {"VIE", "BER"})}
+    assert pushdown_params("reservations", filters) == {
+        "dateFilter": "Arrival", "from": "2024-05-31T00:00:00Z", "to": "2024-07-02T00:00:00Z", "propertyIds": "BER,VIE",
+    }
+    assert pushdown_params("units", {"property.id": ("in", {"VIE", "BER"})}) == {}
+    assert pushdown_params("units", {"property.id": ("in", {"VIE"})}) == {"propertyId": "VIE"}
+
+
+ROWS = [
+    {"id": "R1", "arrival": "2024-06-01", "departure": "2024-06-03", "status": "Confirmed"},
+    {"id": "R2", "arrival": "2024-06-02", "departure": "2024-06-09", "status": "Confirmed"},
+    {"id": "R3", "arrival": "2024-06-05", "departure": "2024-06-06", "status": "Canceled"},
+]
+
+
+def fake_upstream(monkeypatch, rows=ROWS):
+    queries = []
+
+    def iter_pages(relative_path, list_key, params=None, **kwargs):
+        queries.append(dict(params))
+        yield {list_key: rows, "count": len(rows)}
+
+    schema = {key: "str" for key in rows[0]}
+    monkeypatch.setattr(lazy_scan, "get_schema", lambda path, list_key, **kwargs: {list_key: [schema]})
+    monkeypatch.setattr(http_client, "iter_pages", iter_pages)
+    return queries
+
+
+def test_scan_pushes_predicate_and_filters_locally(monkeypatch):
+    queries = fake_upstream(monkeypatch)
+    df = lazy_scan.scan_endpoint("reservations").filter(pl.col("status") == "Confirmed").select("id").collect()
+    assert df["id"].to_list() == ["R1", "R2"]
+    assert queries == [{"status": "Confirmed"}]
+
+
+def test_scan_reservations_pushes_arrival_and_filters_departure_locally(monkeypatch):
+    queries = fake_upstream(monkeypatch)
+    df = lazy_scan.scan_reservations(arrival_to="2024-06-30", departure_from="2024-06-05").collect()
+    assert queries == [{"dateFilter": "Arrival", "to": "2024-07-01T00:00:00Z"}]
+    assert df["id"].to_list() == ["R2", "R3"]
+
+
+def test_scan_reservations_pushes_departure_without_arrival(monkeypatch):
+    queries = fake_upstream(monkeypatch)
+    df = lazy_scan.scan_reservations(departure_from="2024-06-05", departure_to="2024-06-07").collect()
+    assert queries == [{"dateFilter": "Departure", "from": "2024-06-04T00:00:00Z", "to": "2024-06-08T00:00:00Z"}]
+    assert df["id"].to_list() == ["R3"]
+
+
+def test_scan_reservations_filters_both_ranges_by_day(monkeypatch):
+    rows = [
+        {"id": "R1", "arrival": "2024-05-31T15:00:00Z", "departure": "2024-06-03T11:00:00Z"},
+        {"id": "R2", "arrival": "2024-06-01T15:00:00Z", "departure": "2024-06-07T11:00:00Z"},
+        {"id": "R3", "arrival": "2024-06-02T15:00:00Z", "departure": "2024-06-08T11:00:00Z"},
+    ]
+    queries = fake_upstream(monkeypatch, rows)
+    df = lazy_scan.scan_reservations(arrival_from="2024-06-01", departure_to="2024-06-07").collect()
+    assert queries == [{"dateFilter": "Arrival", "from": "2024-05-31T00:00:00Z"}]
+    assert df["id"].to_list() == ["R2"]
+
+
+def test_scan_raises_when_a_column_drifts_from_the_declared_schema(monkeypatch):
+    fake_upstream(monkeypatch)
+    schema = {"id": "str", "arrival": "str", "departure": "str", "status": "int"}
+    monkeypatch.setattr(lazy_scan, "get_schema", lambda path, list_key, **kwargs: {list_key: [schema]})
+    with pytest.raises(pl.exceptions.ComputeError, match="inferred schema: status"):
+        lazy_scan.scan_endpoint("reservations").collect()
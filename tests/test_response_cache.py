@@ -0,0 +1,132 @@
+import json
+import pytest
+import http_client
+from disk_cache import DiskCache
+from response_cache import CacheEntry, ResponseCache, SerializedItems, response_cache
+
+
+def entry_for(data, expires_at=float("inf")):
+    return CacheEntry(json.dumps(data).encode("utf-8"), "identity", None, None, expires_at)
+
+
+def test_serialized_page_is_built_once_and_counted():
+    cache = ResponseCache()
+    entry = entry_for({"items": [{"id": 1}, {"id": 2}], "count": 5})
+    cache.put_entry("/x?pageNumber=1", entry)
+    before = cache.snapshot()["bytes"]
+    parsed = []
+    page = cache.serialized_page("/x?pageNumber=1", entry, "items", on_parse=parsed.append)
+    assert isinstance(page["items"], SerializedItems)
+    assert len(page["items"]) == 2 and page["count"] == 5
+    assert json.loads(b"[" + page["items"].body + b"]") == [{"id": 1}, {"id": 2}]
+    assert cache.serialized_page("/x?pageNumber=1", entry, "items", on_parse=parsed.append)["items"] is page["items"]
+    assert parsed == [[{"id": 1}, {"id": 2}]]
+    assert cache.snapshot()["bytes"] == before + len(page["items"].body)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.raw = self
+
+    def read(self, decode_content=True):
+        return self.body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    # Serves /x with ETag "v<version>"; If-None-Match with the current ETag gets a 304
+    state = {"version": 1, "requests": []}
+
+    def get(relative_path, params=None, stream=False, headers=None):
+        state["requests"].append(dict(headers or {}))
+        etag = f'"v{state["version"]}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return FakeResponse(304, headers={"ETag": etag})
+        return FakeResponse(200, json.dumps({"version": state["version"]}).encode("utf-8"), {"ETag": etag})
+
+    monkeypatch.setattr(http_client, "get", get)
+    return state
+
+
+def expire(cache, key):
+    cache.get_entry(key).expires_at = 0
+
+
+def test_fresh_entries_are_served_without_upstream_requests(upstream):
+    cache = ResponseCache(default_ttl=60)
+    assert cache.fetch("/x").json() == {"version": 1}
+    assert cache.fetch("/x").json() == {"version": 1}
+    assert len(upstream["requests"]) == 1
+    assert (cache.stats["misses"], cache.stats["hits"]) == (1, 1)
+
+
+def test_expired_entries_are_revalidated_with_their_etag(upstream):
+    cache = ResponseCache(default_ttl=60, stale_while_revalidate=False)
+    first = cache.fetch("/x")
+    expire(cache, "/x")
+    assert cache.fetch("/x") is first
+    assert first.is_fresh()
+    assert upstream["requests"][-1] == {"If-None-Match": '"v1"'}
+    assert cache.stats["not_modified"] == 1
+
+    upstream["version"] = 2
+    expire(cache, "/x")
+    assert cache.fetch("/x").json() == {"version": 2}
+    assert cache.get_entry("/x").etag == '"v2"'
+
+
+def test_no_cache_forces_revalidation_of_fresh_entries(upstream):
+    cache = ResponseCache(default_ttl=60)
+    cache.fetch("/x")
+    upstream["version"] = 2
+    assert cache.fetch("/x", no_cache=True).json() == {"version": 2}
+    assert cache.stats["revalidations"] == 1
+
+
+def test_stale_entries_are_served_while_revalidating_in_the_background(upstream):
+    cache = ResponseCache(default_ttl=60, stale_while_revalidate=True)
+    cache.fetch("/x")
+    upstream["version"] = 2
+    expire(cache, "/x")
+    assert cache.fetch("/x").json() == {"version": 1}
+    cache._background.shutdown(wait=True)
+    assert cache.get_entry("/x").json() == {"version": 2}
+    assert cache.stats["stale_hits"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_bytes=30)
+    for key in ("/a", "/b", "/c"):
+        cache.put_entry(key, CacheEntry(b"x" * 10, "identity", None, None, float("inf")))
+    cache.get_entry("/a")
+    cache.put_entry("/d", CacheEntry(b"x" * 10, "identity", None, None, float("inf")))
+    assert list(cache._entries) == ["/c", "/a", "/d"]
+    assert cache.snapshot()["bytes"] == 30 and cache.stats["evictions"] == 1
+    cache.put_entry("/big", CacheEntry(b"x" * 31, "identity", None, None, float("inf")))
+    assert cache.get_entry("/big") is None
+
+
+def test_invalidate_drops_matching_keys():
+    cache = ResponseCache()
+    for key in ("/x?propertyId=A", "/x?propertyId=B", "/y"):
+        cache.put_entry(key, CacheEntry(b"{}", "identity", None, None, float("inf")))
+    assert cache.invalidate("/x", lambda key: key.endswith("A")) == 1
+    assert sorted(cache._entries) == ["/x?propertyId=B", "/y"]
+
+
+def test_disk_tier_is_only_created_when_attached(tmp_path):
+    assert response_cache.disk is None
+    cache = ResponseCache()
+    cache.attach_disk(DiskCache(str(tmp_path / "responses.sqlite3")))
+    cache.put_entry("/x", entry_for({"items": []}))
+    cache._disk_writer.submit(lambda: None).result()
+    assert ResponseCache(disk=cache.disk).get_entry("/x") is not None
@@ -0,0 +1,91 @@
+import json
+import polars as pl
+from schema_utils import SCHEMA_SAMPLE_ROWS, SchemaRegistry, infer_schema_from_rows, merge_schema, rows_to_df
+
+
+# Converts rows with the schema of the first three only, like a schema registered
+# from an earlier page
+def build(rows):
+    return rows_to_df(rows, infer_schema_from_rows(rows[:3]))
+
+
+def test_null_field_that_later_holds_an_object_is_kept_as_json():
+    rows = [{"a": None, "b": 1}] * 3 + [{"a": {"x": 1}, "b": 2}]
+    df = build(rows)
+    assert df.schema["a"] == pl.String
+    assert json.loads(df["a"][3]) == {"x": 1}
+    assert df["b"].to_list() == [1, 1, 1, 2]
+
+
+def test_int_field_that_later_receives_a_string_is_kept_as_text():
+    rows = [{"a": "s", "b": 1}] * 3 + [{"a": "s", "b": "oops"}]
+    df = build(rows)
+    assert df.schema["b"] == pl.String
+    assert df["b"].to_list() == ["1", "1", "1", "oops"]
+    assert df.schema["a"] == pl.String
+
+
+def test_int_in_a_bool_field_is_kept_as_text():
+    rows = [{"a": True}] * 3 + [{"a": 1}]
+    df = build(rows)
+    assert df.schema["a"] == pl.String
+    assert df["a"].to_list() == ["true", "true", "true", "1"]
+
+
+def test_float_in_an_int_field_is_not_truncated():
+    df = rows_to_df([{"a": 1}, {"a": 2.5}], {"a": "int"})
+    assert df["a"].to_list() == ["1", "2.5"]
+
+
+def test_string_in_a_struct_field_is_kept_as_json():
+    rows = [{"a": {"x": 1}}] * 3 + [{"a": {"x": "oops"}}]
+    df = build(rows)
+    assert df.schema["a"] == pl.String
+    assert json.loads(df["a"][3]) == {"x": "oops"}
+
+
+def test_keys_missing_from_the_schema_are_kept_as_text():
+    df = rows_to_df([{"a": 1, "b": {"x": [1]}}], {"a": "int"})
+    assert df.schema["a"] == pl.Int64
+    assert json.loads(df["b"][0]) == {"x": [1]}
+
+
+def test_ints_in_float_list_fields_are_widened():
+    df = rows_to_df([{"a": [{"x": 1.5}, {"x": 1}]}], {"a": [{"x": "float"}]})
+    assert df["a"][0].to_list() == [{"x": 1.5}, {"x": 1.0}]
+
+
+def test_rows_that_fit_keep_native_nested_columns():
+    rows = [{"a": {"x": 1, "y": "z"}, "b": [1, 2]}, {"a": None, "b": []}]
+    df = build(rows)
+    assert isinstance(df.schema["a"], pl.Struct)
+    assert df["a"][0] == {"x": 1, "y": "z"}
+
+
+def test_merge_schema_of_string_and_object_keeps_the_first():
+    assert merge_schema("str", {"x": "int"}) == "str"
+    assert merge_schema({"x": "int"}, "str") == {"x": "int"}
+    assert merge_schema("int", "float") == "float"
+    assert merge_schema("int", "int") == "int"
+
+
+def test_fields_after_the_sample_are_detected():
+    rows = [{"id": n, "guest": {"name": "a"}} for n in range(SCHEMA_SAMPLE_ROWS + 10)]
+    rows[-5] = {**rows[-5], "late": "x"}
+    rows[-3] = {**rows[-3], "guest": {"name": "b", "email": "b@example.com"}}
+    schema = infer_schema_from_rows(rows)
+    assert schema["late"] == "str"
+    assert schema["guest"] == {"name": "str", "email": "str"}
+    df = rows_to_df(rows, schema)
+    assert df["late"].drop_nulls().to_list() == ["x"]
+    assert df["guest"].struct.field("email").drop_nulls().to_list() == ["b@example.com"]
+
+
+def test_registry_picks_up_nested_fields_in_later_chunks():
+    registry = SchemaRegistry()
+    first = registry.observe("/test/v1/items", [{"id": 1, "lines": [{"amount": 1}]}])
+    assert first["version"] == 1
+    assert registry.observe("/test/v1/items", [{"id": 2, "lines": [{"amount": 2}]}])["version"] == 1
+    later = registry.observe("/test/v1/items", [{"id": 3, "lines": [{"amount": 2}, {"amount": 1.5, "tax": 0.1}]}])
+    assert later["version"] == 2
+    assert later["schema"]["lines"] == [{"amount": "float", "tax": "float"}]
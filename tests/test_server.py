@@ -0,0 +1,72 @@
+import socket
+import threading
+import http.client
+import pytest
+from apaleo_connector import ApaleoHandler
+
+
+class SlowHandler(ApaleoHandler):
+    # GET /slow blocks until the test releases it; everything else is served normally
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def do_GET(self):
+        if self.path == "/slow":
+            self.started.release()
+            self.release.wait(10)
+        super().do_GET()
+
+
+@pytest.fixture
+def serve(connector):
+    SlowHandler.release.clear()
+    yield lambda **kwargs: connector(SlowHandler, **kwargs)
+    SlowHandler.release.set()
+
+
+def get(port, path="/limiter/stats", connection=None):
+    connection = connection or http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    return connection, response.status
+
+
+def test_idle_keep_alive_connections_do_not_hold_workers(serve):
+    port = serve(max_workers=2, max_connections=16)
+    idle = [get(port)[0] for _ in range(6)]
+    assert [get(port, connection=connection)[1] for connection in idle] == [200] * 6
+    assert get(port)[1] == 200
+    for connection in idle:
+        connection.close()
+
+
+def test_requests_beyond_the_workers_get_503(serve):
+    port = serve(max_workers=2, max_connections=16)
+    busy = [threading.Thread(target=get, args=(port, "/slow")) for _ in range(2)]
+    for thread in busy:
+        thread.start()
+    for _ in busy:
+        assert SlowHandler.started.acquire(timeout=5)
+    assert get(port)[1] == 503
+    SlowHandler.release.set()
+    for thread in busy:
+        thread.join(5)
+    assert get(port)[1] == 200
+
+
+def test_connections_beyond_the_cap_get_503(serve):
+    port = serve(max_workers=2, max_connections=2)
+    opened = [get(port) for _ in range(2)]
+    assert [status for _, status in opened] == [200, 200]
+    idle = [connection for connection, _ in opened]
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as extra:
+        assert extra.recv(1024).startswith(b"HTTP/1.1 503")
+    idle[0].close()
+    # The server notices the closed connection and frees its place
+    for _ in range(50):
+        connection, status = get(port)
+        connection.close()
+        if status == 200:
+            break
+    assert status == 200
@@ -0,0 +1,100 @@
+import json
+import http_client
+import stream_ingest
+from stream_ingest import iter_items, iter_json_items
+
+
+def pieces(data: bytes, size: int):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_iter_json_items_across_chunk_boundaries():
+    document = {"reservations": [{"id": "R1", "amount": 12.5, "name": "Zoë"}, {"id": "R2", "tags": [1, 2]}], "count": 2}
+    data = json.dumps(document).encode("utf-8")
+    for size in (1, 2, 7, len(data)):
+        meta = {}
+        assert list(iter_json_items(pieces(data, size), "reservations", meta)) == document["reservations"]
+        assert meta == {"count": 2}
+    assert list(iter_json_items([b"[1, 2", b"3]"])) == [1, 23]
+    assert list(iter_json_items([b"{}"], "items")) == []
+
+
+class StreamedResponse:
+    def __init__(self, body: dict):
+        self.status_code = 200
+        self.data = json.dumps(body).encode("utf-8")
+        self.closed = False
+
+    def iter_content(self, size):
+        return iter(pieces(self.data, 5))
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test_iter_items_pages_through_streamed_responses(monkeypatch):
+    rows = [{"id": n} for n in range(7)]
+    opened = []
+
+    def get(relative_path, params=None, token=None, stream=False):
+        assert stream
+        start = (params["pageNumber"] - 1) * params["pageSize"]
+        response = StreamedResponse({"items": rows[start:start + params["pageSize"]], "count": len(rows)})
+        opened.append(response)
+        return response
+
+    monkeypatch.setattr(http_client, "get", get)
+    monkeypatch.setattr(http_client, "get_access_token", lambda: "token")
+    assert list(iter_items("/x", "items", page_size=3)) == rows
+    assert len(opened) == 3 and all(response.closed for response in opened)
+
+
+def test_items_are_yielded_while_the_page_downloads(monkeypatch):
+    rows = [{"id": n, "name": "x" * 50} for n in range(100)]
+    response = StreamedResponse({"items": rows, "count": len(rows)})
+    served = []
+
+    def iter_content(size):
+        for piece in pieces(response.data, 64):
+            served.append(piece)
+            yield piece
+
+    response.iter_content = iter_content
+    monkeypatch.setattr(http_client, "get", lambda relative_path, params=None, token=None, stream=False: response)
+    monkeypatch.setattr(http_client, "get_access_token", lambda: "token")
+    items = iter_items("/x", "items", page_size=100)
+    assert next(items) == rows[0]
+    assert sum(map(len, served)) < len(response.data) // 10
+    assert list(items) == rows[1:]
+    assert response.closed
+
+
+def test_abandoned_iteration_closes_opened_pages(monkeypatch):
+    opened = []
+
+    def get(relative_path, params=None, token=None, stream=False):
+        response = StreamedResponse({"items": [{"id": params["pageNumber"]}], "count": 5})
+        opened.append(response)
+        return response
+
+    monkeypatch.setattr(http_client, "get", get)
+    monkeypatch.setattr(http_client, "get_access_token", lambda: "token")
+    items = iter_items("/x", "items", page_size=1)
+    assert next(items) == {"id": 1}
+    items.close()
+    assert all(response.closed for response in opened)
+
+
+def test_load_streaming_concatenates_chunks_with_new_fields(monkeypatch):
+    rows = [{"id": "R1"}, {"id": "R2"}, {"id": "R3", "extra": {"a": 1}}]
+    monkeypatch.setattr(stream_ingest, "iter_items", lambda *args, **kwargs: iter(rows))
+    monkeypatch.setitem(stream_ingest.ENDPOINTS, "test", {"path": "/test/v1/stream", "list_key": "items", "paged": True})
+    df = stream_ingest.load_streaming("test", chunk_rows=2)
+    assert df["id"].to_list() == ["R1", "R2", "R3"]
+    assert df["extra"].struct.field("a").to_list() == [None, None, 1]
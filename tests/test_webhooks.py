@@ -0,0 +1,98 @@
+import json
+import socket
+import http.client
+import pytest
+import requests
+import http_client
+import sync_store
+import webhooks
+from apaleo_connector import ApaleoHandler
+from response_cache import CacheEntry, ResponseCache
+from webhooks import EventBatcher
+
+
+def post(port, path, body: bytes, headers: dict = None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("POST", path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    events = []
+    monkeypatch.setattr(webhooks.batcher, "submit", lambda batch: events.extend(batch) or len(batch))
+    return events
+
+
+EVENT = json.dumps({"topic": "Unit", "type": "changed", "propertyId": "P01", "data": {"entityId": "U1"}}).encode()
+
+
+def test_webhooks_are_disabled_without_a_secret(connector, submitted, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "")
+    port = connector(ApaleoHandler)
+    assert post(port, "/webhooks/apaleo", EVENT) == 404
+    assert submitted == []
+
+
+def test_webhooks_need_the_configured_secret(connector, submitted, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "s3cret")
+    port = connector(ApaleoHandler)
+    assert post(port, "/webhooks/apaleo?secret=wrong", EVENT) == 403
+    assert post(port, "/webhooks/apaleo?secret=s3cret", EVENT) == 202
+    assert post(port, "/webhooks/apaleo", EVENT, {"X-Webhook-Secret": "s3cret"}) == 202
+    assert len(submitted) == 2
+
+
+def test_invalid_content_length_is_rejected(connector, submitted, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_SECRET", "s3cret")
+    port = connector(ApaleoHandler)
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as client:
+        client.sendall(b"POST /webhooks/apaleo?secret=s3cret HTTP/1.1\r\nHost: test\r\nContent-Length: abc\r\n\r\n")
+        assert client.recv(1024).startswith(b"HTTP/1.1 400")
+    assert submitted == []
+
+
+def cached(cache, key):
+    cache.put_entry(key, CacheEntry(b"{}", None, None, None, float("inf")))
+
+
+def test_events_drop_only_the_affected_cache_keys(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(webhooks, "response_cache", cache)
+    for key in ("/inventory/v1/units", "/inventory/v1/units?propertyId=P01", "/inventory/v1/units?propertyId=P02",
+                "/inventory/v1/unit-groups?propertyId=P01", "/booking/v1/reservations?propertyIds=P01,P02"):
+        cached(cache, key)
+    batcher = EventBatcher(debounce=60, max_delay=60)
+    assert batcher.submit([json.loads(EVENT), json.loads(EVENT), {"topic": "Nothing"}]) == 2
+    batcher.flush()
+    assert sorted(cache._entries) == ["/booking/v1/reservations?propertyIds=P01,P02",
+                                      "/inventory/v1/unit-groups?propertyId=P01",
+                                      "/inventory/v1/units?propertyId=P02"]
+    stats = batcher.snapshot()
+    assert (stats["received"], stats["collapsed"], stats["ignored"], stats["invalidated_keys"]) == (2, 1, 1, 2)
+
+
+def test_changed_records_are_fetched_and_missing_ones_deleted(monkeypatch):
+    monkeypatch.setattr(webhooks, "response_cache", ResponseCache())
+    applied = []
+    monkeypatch.setattr(sync_store, "apply_changes", lambda entity, rows, deleted: applied.append((entity, rows, deleted)) or True)
+
+    class Response:
+        status_code = 404
+
+    def get(relative_path, **kwargs):
+        if relative_path.endswith("/R2"):
+            raise requests.HTTPError(response=Response())
+        return relative_path
+
+    monkeypatch.setattr(http_client, "get", get)
+    monkeypatch.setattr(http_client, "read_json", lambda path: {"id": path.rsplit("/", 1)[1]})
+    batcher = EventBatcher(debounce=60, max_delay=60)
+    batcher.submit([{"topic": "Reservation", "type": "changed", "propertyId": "P01", "data": {"entityId": entity_id}}
+                    for entity_id in ("R1", "R2")]
+                   + [{"topic": "Reservation", "type": "deleted", "propertyId": "P01", "data": {"entityId": "R3"}}])
+    batcher.flush()
+    assert applied == [("reservations", [{"id": "R1"}], {"R2", "R3"})]
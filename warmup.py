@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import heapq
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import http_client
+from endpoints import ENDPOINTS, AGE_CATEGORIES
+from response_cache import response_cache
+from schema_utils import get_schema, schema_registry, SCHEMA_SAMPLE_ROWS
+from fanout import fetch_per_property, property_list
+
+# Prefetch every registered endpoint at startup and keep it warm afterwards (opt-in:
+# every run re-pulls each endpoint, which costs full pages unless Apaleo answers 304)
+WARMUP_ENABLED = os.getenv("APALEO_WARMUP", "false").lower() == "true"
+# Seconds between refreshes per endpoint, e.g. '{"reservations": 45, "units": 600}'.
+# Endpoints without an entry are refreshed shortly before their cache TTL runs out.
+WARMUP_INTERVALS = json.loads(os.getenv("APALEO_WARMUP_INTERVALS", "{}"))
+# Share of the cache TTL used as the default interval
+WARMUP_TTL_FACTOR = float(os.getenv("APALEO_WARMUP_TTL_FACTOR", "0.8"))
+# Each run is moved by up to this share of its interval, so refreshes do not line up
+WARMUP_JITTER = float(os.getenv("APALEO_WARMUP_JITTER", "0.1"))
+# Startup prefetches are spread over this many seconds
+WARMUP_STARTUP_SPREAD = float(os.getenv("APALEO_WARMUP_STARTUP_SPREAD", "5"))
+# Endpoints warmed at the same time
+WARMUP_WORKERS = int(os.getenv("APALEO_WARMUP_WORKERS", "2"))
+
+
+def _refresh_json(relative_path, params=None):
+    # Revalidates (or fetches) through the cache, so an unchanged body costs only a 304
+    return response_cache.fetch(relative_path, params, no_cache=True).json()
+
+
+# Pulls all pages with the same cache keys a client request uses, plus the schema sample
+def warm_endpoint(endpoint: dict) -> int:
+    count = 0
+    if endpoint["paged"]:
+        pages = http_client.iter_pages(endpoint["path"], endpoint["list_key"], fetch_json=_refresh_json)
+    else:
+        pages = [_refresh_json(endpoint["path"])]
+    for page in pages:
+        items = page.get(endpoint["list_key"], [])
+        if items:
+            schema_registry.observe(endpoint["path"], items)
+        count += len(items)
+    sample = {"pageNumber": 1, "pageSize": SCHEMA_SAMPLE_ROWS} if endpoint["paged"] else None
+    get_schema(endpoint["path"], list_key=endpoint["list_key"], params=sample, fetch_json=response_cache.fetch_json)
+    return count
+
+
+def warm_age_categories() -> int:
+    categories, errors = fetch_per_property(AGE_CATEGORIES, [], fetch_json=_refresh_json)
+    if categories:
+        schema_registry.observe(AGE_CATEGORIES["path"], categories)
+    if errors:
+        raise Exception(f"{len(errors)} properties failed: " + ", ".join(sorted(errors)))
+    property_ids = property_list.get(response_cache.fetch_json)
+    if property_ids:
+        get_schema(AGE_CATEGORIES["path"], list_key=AGE_CATEGORIES["list_key"],
+                   params={"propertyId": property_ids[0]}, fetch_json=response_cache.fetch_json)
+    return len(categories)
+
+
+def default_targets() -> dict:
+    targets = {name: (lambda endpoint=endpoint: warm_endpoint(endpoint), endpoint["ttl"])
+               for name, endpoint in ENDPOINTS.items()}
+    targets["age-categories"] = (warm_age_categories, AGE_CATEGORIES["ttl"])
+    return {
+        name: {"run": run, "interval": float(WARMUP_INTERVALS.get(name, ttl * WARMUP_TTL_FACTOR))}
+        for name, (run, ttl) in targets.items()
+    }
+
+
+class WarmupScheduler:
+    # Runs each target at startup (spread over a few seconds) and then every interval ± jitter
+    def __init__(self, targets: dict, workers: int = WARMUP_WORKERS, jitter: float = WARMUP_JITTER,
+                 startup_spread: float = WARMUP_STARTUP_SPREAD):
+        self.targets = targets
+        self.jitter = jitter
+        self.startup_spread = startup_spread
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="warmup")
+        self._queue = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.status = {
+            name: {"interval": target["interval"], "state": "pending", "runs": 0, "items": None,
+                   "last_refresh": None, "duration": None, "error": None, "next_run": None}
+            for name, target in targets.items()
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        now = time.time()
+        with self._cond:
+            for name in self.targets:
+                self._schedule(name, now + random.uniform(0, self.startup_spread))
+        self._thread = threading.Thread(target=self._run, name="warmup-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _schedule(self, name, at):
+        heapq.heappush(self._queue, (at, name))
+        self.status[name]["next_run"] = at
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._queue or self._queue[0][0] > time.time()):
+                    self._cond.wait(self._queue[0][0] - time.time() if self._queue else None)
+                if self._stopped:
+                    return
+                _, name = heapq.heappop(self._queue)
+                self.status[name]["state"] = "running"
+                self.status[name]["next_run"] = None
+            self._pool.submit(self._warm, name)
+
+    def _warm(self, name):
+        target = self.targets[name]
+        started = time.monotonic()
+        try:
+            items = target["run"]()
+            error = None
+        except Exception as e:
+            items = None
+            error = str(e)
+            print(f"[ERROR] Warm-up of {name} failed: {e}")
+        interval = target["interval"]
+        with self._cond:
+            status = self.status[name]
+            status["runs"] += 1
+            status["duration"] = round(time.monotonic() - started, 3)
+            status["error"] = error
+            status["state"] = "error" if error else "ok"
+            if not error:
+                status["items"] = items
+                status["last_refresh"] = time.time()
+            self._schedule(name, time.time() + interval * (1 + random.uniform(-self.jitter, self.jitter)))
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        def iso(ts):
+            return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds") if ts else None
+
+        with self._cond:
+            endpoints = {
+                name: {**status, "last_refresh": iso(status["last_refresh"]), "next_run": iso(status["next_run"])}
+                for name, status in self.status.items()
+            }
+        warmed = sum(1 for status in endpoints.values() if status["last_refresh"])
+        return {"enabled": self._thread is not None, "warmed": warmed, "total": len(endpoints), "endpoints": endpoints}
+
+
+scheduler = WarmupScheduler(default_targets())
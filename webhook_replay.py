@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import requests
+
+# Sends Apaleo webhook events to a running connector, from a recorded JSONL file or
+# generated for the synthetic records of fake_apaleo.py. No Apaleo account needed.
+
+
+def load_events(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Events in Apaleo's webhook format for ids of fake_apaleo.py's synthetic data
+def synthetic_events(count: int, topic: str, event_type: str, property_ids: list, max_index: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    events = []
+    for n in range(count):
+        i = rng.randrange(max_index)
+        # fake_apaleo assigns record i to property i % len(properties)
+        i -= i % len(property_ids)
+        k = rng.randrange(len(property_ids))
+        i += k
+        entity_id = f"RES{i:08d}-1" if topic.lower() == "reservation" else f"RES{i:08d}-1-1"
+        events.append({
+            "id": f"evt-{seed}-{n}",
+            "topic": topic,
+            "type": event_type,
+            "accountId": "FAKE",
+            "propertyId": property_ids[k],
+            "data": {"entityId": entity_id},
+            "timestamp": int(time.time() * 1000),
+        })
+    return events
+
+
+def replay(url: str, events: list, rate: float = 0, batch_size: int = 1, secret: str = "") -> dict:
+    session = requests.Session()
+    headers = {"X-Webhook-Secret": secret} if secret else {}
+    accepted = 0
+    failed = 0
+    started = time.perf_counter()
+    for n in range(0, len(events), batch_size):
+        batch = events[n:n + batch_size]
+        response = session.post(url, json=batch if batch_size > 1 else batch[0], headers=headers, timeout=10)
+        if response.status_code == 202:
+            accepted += response.json().get("accepted", 0)
+        else:
+            failed += len(batch)
+        if rate:
+            # Keep the requested event rate
+            delay = (n + len(batch)) / rate - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+    return {"sent": len(events), "accepted": accepted, "failed": failed,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay Apaleo webhook events against the connector")
+    parser.add_argument("--url", default="http://localhost:8000/webhooks/apaleo")
+    parser.add_argument("--secret", default=os.getenv("APALEO_WEBHOOK_SECRET", ""))
+    parser.add_argument("--file", help="JSONL file with one recorded event per line")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate this many events instead")
+    parser.add_argument("--topic", default="Reservation", choices=["Reservation", "Folio"])
+    parser.add_argument("--type", default="changed")
+    parser.add_argument("--properties", default="P00,P01,P02,P03,P04", help="Property IDs used by the fake")
+    parser.add_argument("--max-index", type=int, default=10000, help="Number of synthetic records in the fake")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0, help="Events per second (0: as fast as possible)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Events per POST")
+    parser.add_argument("--fake", help="fake_apaleo.py URL; the records are changed there before the events are sent")
+    parser.add_argument("--wait", type=float, default=0, help="Seconds to wait before printing the connector's webhook stats")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.file:
+        events = load_events(args.file)
+    elif args.synthetic:
+        events = synthetic_events(args.synthetic, args.topic, args.type, args.properties.split(","), args.max_index, args.seed)
+    else:
+        sys.exit("Pass --file or --synthetic")
+    if args.fake:
+        for kind in ("reservation", "folio"):
+            ids = [e["data"]["entityId"] for e in events if str(e.get("topic", "")).lower() == kind]
+            if ids:
+                requests.post(f"{args.fake}/_touch", json={"kind": kind, "ids": ids}, timeout=10).raise_for_status()
+    print(json.dumps(replay(args.url, events, args.rate, args.batch_size, args.secret)))
+    if args.wait:
+        time.sleep(args.wait)
+        stats_url = args.url.rsplit("/webhooks/", 1)[0] + "/webhooks/stats"
+        print(requests.get(stats_url, timeout=10).text)
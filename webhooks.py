@@ -0,0 +1,223 @@
+import os
+import hmac
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+import requests
+import http_client
+import sync_store
+import analytics
+from endpoints import ENDPOINTS
+from response_cache import response_cache
+from fanout import property_list
+
+# Shared secret expected as ?secret=... or X-Webhook-Secret header; empty disables the webhook route
+WEBHOOK_SECRET = os.getenv("APALEO_WEBHOOK_SECRET", "")
+# Events are collected for this many seconds after the last one before they are applied ...
+WEBHOOK_DEBOUNCE = float(os.getenv("APALEO_WEBHOOK_DEBOUNCE", "2"))
+# ... but a batch never waits longer than this after its first event
+WEBHOOK_MAX_DELAY = float(os.getenv("APALEO_WEBHOOK_MAX_DELAY", "10"))
+# Up to this many changed records per entity are fetched one by one; more trigger an incremental sync
+WEBHOOK_MAX_ITEM_FETCHES = int(os.getenv("APALEO_WEBHOOK_MAX_ITEM_FETCHES", "50"))
+
+# Apaleo event topic -> registered endpoints whose cached responses it affects.
+# "entity" names the local store entity whose records are fetched by id.
+TOPICS = {
+    "reservation": {"endpoints": ["reservations", "bookings"], "entity": "reservations",
+                    "item_path": "/booking/v1/reservations/{id}"},
+    "booking": {"endpoints": ["bookings", "reservations"]},
+    "folio": {"endpoints": ["folios"], "entity": "folios", "item_path": "/finance/v1/folios/{id}"},
+    "unit": {"endpoints": ["units"]},
+    "unitgroup": {"endpoints": ["unit-groups", "units"]},
+    "property": {"endpoints": ["properties"], "properties": True},
+    "service": {"endpoints": ["services"]},
+}
+# Event types after which a record no longer exists upstream
+DELETED_TYPES = {"deleted", "removed"}
+
+
+def _topic(event: dict) -> str:
+    return str(event.get("topic", "")).replace("-", "").replace("_", "").lower()
+
+
+def _entity_id(event: dict):
+    data = event.get("data")
+    if isinstance(data, dict) and data.get("entityId"):
+        return data["entityId"]
+    return event.get("entityId")
+
+
+# True if a cached key (path?query) may contain records of the given properties.
+# Keys without a property filter cover every property.
+def _key_matches(key: str, property_ids: set) -> bool:
+    if None in property_ids:
+        return True
+    params = dict(parse_qsl(key.partition("?")[2]))
+    requested = params.get("propertyIds") or params.get("propertyId")
+    if not requested:
+        return True
+    return bool(property_ids & set(requested.split(",")))
+
+
+class EventBatcher:
+    # Collects webhook events and applies them in debounced batches: repeated events
+    # for the same record collapse, and each affected cache key is dropped once.
+    def __init__(self, debounce=WEBHOOK_DEBOUNCE, max_delay=WEBHOOK_MAX_DELAY, max_item_fetches=WEBHOOK_MAX_ITEM_FETCHES):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_item_fetches = max_item_fetches
+        self._pending = {}
+        self._first_at = None
+        self._last_at = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhook-refresh")
+        self.stats = {
+            "received": 0,
+            "ignored": 0,
+            "batches": 0,
+            "collapsed": 0,
+            "invalidated_keys": 0,
+            "records_fetched": 0,
+            "records_deleted": 0,
+            "syncs": 0,
+            "errors": 0,
+            "last_batch": None,
+        }
+
+    # Queues events; returns how many were accepted
+    def submit(self, events: list) -> int:
+        accepted = 0
+        now = time.monotonic()
+        with self._lock:
+            for event in events:
+                topic = _topic(event) if isinstance(event, dict) else ""
+                if topic not in TOPICS:
+                    self.stats["ignored"] += 1
+                    continue
+                key = (topic, event.get("propertyId"), _entity_id(event))
+                if key in self._pending:
+                    self.stats["collapsed"] += 1
+                # The last event for a record wins, e.g. changed after created
+                self._pending[key] = str(event.get("type", "")).lower()
+                self.stats["received"] += 1
+                accepted += 1
+            if accepted:
+                self._first_at = self._first_at or now
+                self._last_at = now
+                self._schedule(now)
+        return accepted
+
+    def _schedule(self, now):
+        # Caller holds _lock
+        flush_at = min(self._last_at + self.debounce, self._first_at + self.max_delay)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(0.0, flush_at - now), self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = {}
+            self._first_at = self._last_at = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if batch:
+            with self._apply_lock:
+                try:
+                    self._apply(batch)
+                except Exception as e:
+                    self._count("errors")
+                    print(f"[ERROR] Applying webhook batch failed: {e}")
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _apply(self, batch: dict):
+        started = time.monotonic()
+        # Endpoint -> properties whose cached responses are stale (None: all properties)
+        stale = {}
+        # Store entity -> {"changed": {...ids}, "deleted": {...ids}}
+        records = {}
+        for (topic, property_id, entity_id), event_type in batch.items():
+            config = TOPICS[topic]
+            for name in config["endpoints"]:
+                stale.setdefault(name, set()).add(property_id)
+            if config.get("properties"):
+                property_list.invalidate()
+            if config.get("entity") and entity_id:
+                kind = "deleted" if event_type in DELETED_TYPES else "changed"
+                records.setdefault(config["entity"], {"changed": set(), "deleted": set(), "topic": topic})[kind].add(entity_id)
+
+        invalidated = 0
+        for name, property_ids in stale.items():
+            invalidated += response_cache.invalidate(ENDPOINTS[name]["path"],
+                                                     lambda key, ids=property_ids: _key_matches(key, ids))
+        self._count("invalidated_keys", invalidated)
+
+        for entity, changes in records.items():
+            self._update_store(entity, TOPICS[changes["topic"]]["item_path"], changes["changed"] - changes["deleted"],
+                               changes["deleted"])
+
+        # Derived tables are rebuilt off this thread; refresh() syncs the store incrementally first
+        for table in analytics.tables.values():
+            if any(source in stale or source in records for source in table.sources) and table.df is not None:
+                self._background.submit(self._refresh_table, table)
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["last_batch"] = {
+                "events": len(batch),
+                "endpoints": sorted(stale),
+                "invalidated_keys": invalidated,
+                "seconds": round(time.monotonic() - started, 3),
+                "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+
+    def _update_store(self, entity: str, item_path: str, changed: set, deleted: set):
+        if len(changed) > self.max_item_fetches:
+            # Cheaper as one incremental sync than as many single fetches
+            if entity in sync_store.load_state():
+                sync_store.sync(entity)
+                self._count("syncs")
+            return
+        rows = []
+        for entity_id in sorted(changed):
+            try:
+                rows.append(http_client.read_json(http_client.get(item_path.format(id=entity_id))))
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    deleted = deleted | {entity_id}
+                    continue
+                raise
+        self._count("records_fetched", len(rows))
+        if sync_store.apply_changes(entity, rows, deleted):
+            self._count("records_deleted", len(deleted))
+
+    def _refresh_table(self, table):
+        try:
+            table.refresh()
+        except Exception:
+            pass    # logged by refresh()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending)}
+
+
+batcher = EventBatcher()
+
+
+# Without a configured secret no sender is accepted
+def authorized(query: dict, headers) -> bool:
+    if not WEBHOOK_SECRET:
+        return False
+    given = query.get("secret", [""])[0] or headers.get("X-Webhook-Secret", "")
+    return hmac.compare_digest(given.encode("utf-8"), WEBHOOK_SECRET.encode("utf-8"))